@@ -1,273 +1,200 @@
-import pandas as pd
-from io import BytesIO
-
-import sqlite3
+import calendar
+import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, timedelta, datetime as dt
 
 import streamlit as st
 
+import fx_db
+from fx_db import jobs, recurrence, routes
+
 # =========================
 # CONFIG DB
 # =========================
 DB_NAME = "agenda.db"
 
+DIAS_SEMANA = ["Lun", "Mar", "Mié", "Jue", "Vie", "Sáb", "Dom"]
+
+# Columnas editables de la tabla de servicios → columna en la BD
+COLUMNAS_TABLA_SERV = {
+    "Cliente/Negocio": "client_name",
+    "Plaga": "pest_type",
+    "Zona": "zone",
+    "Dirección": "address",
+    "Teléfono": "phone",
+    "Precio": "price",
+    "Estado": "status",
+    "Cuadrilla": "crew",
+    "Notas": "notes",
+}
 
-def get_conn():
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    return conn
+# Tipos de archivo que producen los trabajos en segundo plano
+MIME_TRABAJOS = {
+    "Excel": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "Respaldo BD": "application/octet-stream",
+    "Parquet": "application/zip",
+}
 
 
 def init_db():
-    conn = get_conn()
-    c = conn.cursor()
-
-    # Tabla de clientes
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS clients (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            business_name TEXT,
-            address TEXT,
-            zone TEXT,
-            phone TEXT,
-            notes TEXT,
-            is_monthly INTEGER DEFAULT 0,
-            monthly_day INTEGER
-        );
-    """)
-
-    # Tabla de servicios (citas)
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS appointments (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            client_name TEXT NOT NULL,
-            service_type TEXT,
-            pest_type TEXT,
-            address TEXT,
-            zone TEXT,
-            phone TEXT,
-            date TEXT NOT NULL,
-            time TEXT NOT NULL,
-            price REAL,
-            status TEXT,
-            notes TEXT,
-            created_at TEXT
-        );
-    """)
-
-    # Asegurar columna para marcar servicio mensual
-    try:
-        c.execute("ALTER TABLE appointments ADD COLUMN is_monthly_service INTEGER DEFAULT 0;")
-    except Exception:
-        # Si ya existe, ignoramos el error
-        pass
-
-    conn.commit()
-    conn.close()
+    fx_db.init_db(sucursal)
 
 
 # ---------- FUNCIONES DB ----------
+# La lógica vive en fx_db; aquí solo se fija la sucursal de la pantalla.
+# Los cachés de Streamlit van por versión de datos (fx_db.get_data_version),
+# así ven también lo que escriben otros procesos o la línea de comandos.
 
 def add_client(name, business_name, address, zone, phone, notes,
                is_monthly=False, monthly_day=None):
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("""
-        INSERT INTO clients (
-            name, business_name, address, zone, phone, notes,
-            is_monthly, monthly_day
-        )
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
-        name,
-        business_name,
-        address,
-        zone,
-        phone,
-        notes,
-        1 if is_monthly else 0,
-        monthly_day,
-    ))
-    conn.commit()
-    conn.close()
-
-
-def update_client(client_id, name, business_name, address, zone, phone, notes):
+    client_id = fx_db.add_client(
+        name, business_name, address, zone, phone, notes,
+        is_monthly=is_monthly, monthly_day=monthly_day, branch=sucursal,
+    )
+    return client_id
+
+
+def update_client(client_id, name, business_name, address, zone, phone, notes,
+                  is_monthly=False, monthly_day=None):
     """Actualiza los datos de un cliente existente."""
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("""
-        UPDATE clients
-        SET name = ?, business_name = ?, address = ?, zone = ?, phone = ?, notes = ?
-        WHERE id = ?
-    """, (
-        name,
-        business_name,
-        address,
-        zone,
-        phone,
-        notes,
-        client_id,
-    ))
-    conn.commit()
-    conn.close()
+    fx_db.update_client(
+        client_id, name, business_name, address, zone, phone, notes,
+        is_monthly=is_monthly, monthly_day=monthly_day, branch=sucursal,
+    )
 
 
 def delete_client(client_id):
     """Elimina un cliente de la tabla clients."""
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("DELETE FROM clients WHERE id = ?", (client_id,))
-    conn.commit()
-    conn.close()
+    fx_db.delete_client(client_id, branch=sucursal)
 
 
 def get_clients():
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("SELECT * FROM clients ORDER BY business_name, name;")
-    rows = c.fetchall()
-    conn.close()
-    return rows
+    return fx_db.get_clients(branch=sucursal)
+
+
+def get_client(client_id):
+    """Regresa un cliente por su ID (o None si no existe)."""
+    return fx_db.get_client(client_id, branch=sucursal)
+
+
+@st.cache_data(max_entries=20)
+def get_client_labels(branch, version):
+    """
+    Regresa (etiquetas, etiqueta -> id) para los selectores de clientes.
+
+    `version` (fx_db.get_data_version) solo entra en la llave de la caché:
+    cualquier escritura, de este proceso o de otro, da una llave nueva.
+    """
+    return fx_db.get_client_labels(branch=branch)
 
 
 def add_appointment(client_name, service_type, pest_type,
                     address, zone, phone, fecha, hora,
-                    price, status, notes, is_monthly_service=False):
-    conn = get_conn()
-    c = conn.cursor()
-    created_at = dt.now().isoformat(timespec="seconds")
-
-    # Nos aseguramos de que la columna exista
-    try:
-        c.execute("ALTER TABLE appointments ADD COLUMN is_monthly_service INTEGER DEFAULT 0;")
-    except Exception:
-        pass
-
-    c.execute("""
-        INSERT INTO appointments (
-            client_name, service_type, pest_type,
-            address, zone, phone,
-            date, time, price,
-            status, notes, created_at, is_monthly_service
-        )
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
-        client_name,
-        service_type,
-        pest_type,
-        address,
-        zone,
-        phone,
-        fecha,
-        hora,
-        price,
-        status,
-        notes,
-        created_at,
-        1 if is_monthly_service else 0,
-    ))
-    conn.commit()
-    conn.close()
+                    price, status, notes, is_monthly_service=False, crew=None,
+                    client_id=None):
+    return fx_db.add_appointment(
+        client_name, service_type, pest_type, address, zone, phone, fecha, hora,
+        price, status, notes, is_monthly_service=is_monthly_service, crew=crew,
+        client_id=client_id, branch=sucursal,
+    )
 
 
 def get_appointments(date_from=None, date_to=None, status=None):
-    conn = get_conn()
-    c = conn.cursor()
+    return fx_db.get_appointments(date_from, date_to, status, branch=sucursal)
 
-    query = "SELECT * FROM appointments WHERE 1=1"
-    params = []
 
-    if date_from:
-        query += " AND date >= ?"
-        params.append(date_from)
-    if date_to:
-        query += " AND date <= ?"
-        params.append(date_to)
-    if status and status != "Todos":
-        query += " AND status = ?"
-        params.append(status)
+def get_calendar_summary(date_from, date_to):
+    return fx_db.get_calendar_summary(date_from, date_to, branch=sucursal)
+
 
-    query += " ORDER BY date, time"
+def get_crews(fecha):
+    return fx_db.get_crews(fecha, branch=sucursal)
 
-    c.execute(query, params)
-    rows = c.fetchall()
-    conn.close()
-    return rows
+
+def get_crew_day(fecha, crew):
+    return fx_db.get_crew_day(fecha, crew, branch=sucursal)
 
 
 def update_status(appointment_id, new_status):
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute(
-        "UPDATE appointments SET status = ? WHERE id = ?",
-        (new_status, appointment_id),
-    )
-    conn.commit()
-    conn.close()
+    fx_db.update_status(appointment_id, new_status, branch=sucursal)
 
 
 def delete_appointment(appointment_id):
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("DELETE FROM appointments WHERE id = ?", (appointment_id,))
-    conn.commit()
-    conn.close()
+    fx_db.delete_appointment(appointment_id, branch=sucursal)
 
 
 def update_appointment_full(appointment_id, client_name, service_type, pest_type,
                             address, zone, phone, fecha, hora,
-                            price, status, notes, is_monthly_service):
+                            price, status, notes, is_monthly_service, crew=None):
     """Actualiza todos los datos principales de un servicio."""
-    conn = get_conn()
-    c = conn.cursor()
-    # asegurar columna
-    try:
-        c.execute("ALTER TABLE appointments ADD COLUMN is_monthly_service INTEGER DEFAULT 0;")
-    except Exception:
-        pass
-
-    c.execute("""
-        UPDATE appointments
-        SET client_name = ?,
-            service_type = ?,
-            pest_type = ?,
-            address = ?,
-            zone = ?,
-            phone = ?,
-            date = ?,
-            time = ?,
-            price = ?,
-            status = ?,
-            notes = ?,
-            is_monthly_service = ?
-        WHERE id = ?
-    """, (
-        client_name,
-        service_type,
-        pest_type,
-        address,
-        zone,
-        phone,
-        fecha,
-        hora,
-        price,
-        status,
-        notes,
-        1 if is_monthly_service else 0,
-        appointment_id,
-    ))
-    conn.commit()
-    conn.close()
+    fx_db.update_appointment_full(
+        appointment_id, client_name, service_type, pest_type, address, zone,
+        phone, fecha, hora, price, status, notes, is_monthly_service,
+        crew=crew, branch=sucursal,
+    )
+
+
+@st.cache_data(max_entries=20, show_spinner=False)
+def get_recurrence_preview(branch, version, hoy, limite=50):
+    """Próximas visitas mensuales por generar; `version` solo es llave de caché."""
+    return fx_db.preview_visits(desde=hoy, limit=limite, branch=branch)
+
+
+@st.cache_data(max_entries=20, show_spinner="Calculando pronóstico…")
+def get_forecast(branch, version, semanas, hoy):
+    """
+    Pronóstico de ingresos y visitas (fx_db.forecast).
+
+    `version` (fx_db.get_data_version) solo entra en la llave de la caché:
+    mientras nadie escriba en la agenda se reusa el resultado.
+    """
+    return fx_db.get_forecast(semanas, hoy=hoy, branch=branch)
+
+
+@st.cache_resource
+def get_executor():
+    """
+    Pool de hilos único para todo el proceso (todas las sesiones).
+
+    Los trabajos pesados corren aquí para no congelar la pantalla.
+    Al crearlo se migran todas las sucursales (la vista consolidada las lee
+    todas) y se marca como interrumpido lo que quedó de un arranque previo.
+    """
+    fx_db.ensure_migrated()
+    for branch in fx_db.list_branches():
+        fx_db.mark_interrupted_jobs(branch)
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="fx-jobs")
 
 
 # =========================
 # INICIO APP
 # =========================
+st.set_page_config(page_title="Agenda FX 2025", layout="wide")
+
+# ==== SUCURSAL ====
+# Cada sucursal tiene su propio archivo .db; todo lo que se guarda en esta
+# pantalla va a la sucursal elegida.
+if "sucursal_creada" in st.session_state:
+    st.session_state["sucursal"] = st.session_state.pop("sucursal_creada")
+
+with st.sidebar:
+    st.markdown("### 🏢 Sucursal")
+    sucursal = st.selectbox("Sucursal", fx_db.list_branches(), key="sucursal")
+    vista_consolidada = st.checkbox(
+        "Ver todas las sucursales (solo lectura)",
+        key="vista_consolidada",
+    )
+    with st.expander("➕ Nueva sucursal"):
+        nombre_sucursal = st.text_input("Nombre de la sucursal", key="nombre_sucursal")
+        if st.button("Crear sucursal") and nombre_sucursal.strip():
+            st.session_state["sucursal_creada"] = fx_db.create_branch(nombre_sucursal)
+            st.rerun()
+
 init_db()
 
-st.set_page_config(page_title="Agenda FX 2025", layout="wide")
+# ANALYZE / vacuum incremental / checkpoint en segundo plano, si ya toca
+fx_db.schedule_maintenance(get_executor(), sucursal)
+
 st.title("📅 Agenda Fumigaciones Xterminio")
 
 # ==== CSS PERSONALIZADO PARA EL SELECTBOX ====
@@ -319,6 +246,7 @@ if "servicio_edit_id" not in st.session_state:
 if st.button("🔄 Actualizar / limpiar pantalla"):
     st.session_state["cliente_edit_id"] = None
     st.session_state["servicio_edit_id"] = None
+    st.session_state["dia_calendario"] = None
     
     # LIMPIAR la caja de búsqueda
     st.session_state["buscar_cliente"] = ""
@@ -334,23 +262,14 @@ dia_hoy = hoy.day
 # =========================
 # CARGAR CLIENTES
 # =========================
-clientes = get_clients()
+# Etiquetas ya calculadas en la BD y compartidas por todos los selectores
+etiquetas_clientes, etiqueta_a_id = get_client_labels(sucursal, fx_db.get_data_version(sucursal))
 
 # =========================
 # FORMULARIO CLIENTE + SERVICIO
 # =========================
 st.subheader("Nuevo servicio / Guardar cliente y agendar")
 
-# Lista de clientes guardados
-opciones = ["-- Cliente nuevo --"]
-mapa_clientes = {}
-for c in clientes:
-    etiqueta = c["business_name"] or c["name"]
-    if c["business_name"] and c["name"]:
-        etiqueta = f"{c['business_name']} ({c['name']})"
-    opciones.append(etiqueta)
-    mapa_clientes[etiqueta] = c
-
 # =========================
 # BUSCADOR DE CLIENTES
 # =========================
@@ -361,29 +280,40 @@ texto_busqueda = st.text_input(
     key="buscar_cliente"
 )
 
-# Construcción de lista normal
-opciones_completas = []
-mapa_clientes = {}
-
-for c in clientes:
-    etiqueta = c["business_name"] or c["name"]
-    if c["business_name"] and c["name"]:
-        etiqueta = f"{c['business_name']} ({c['name']})"
-    opciones_completas.append(etiqueta)
-    mapa_clientes[etiqueta] = c
-
 # Si hay texto → filtramos solo los que EMPIECEN con eso
 if texto_busqueda.strip():
     opciones = ["-- Cliente nuevo --"] + [
-        o for o in opciones_completas
+        o for o in etiquetas_clientes
         if o.lower().startswith(texto_busqueda.lower())
     ]
 else:
-    opciones = ["-- Cliente nuevo --"] + opciones_completas
+    opciones = ["-- Cliente nuevo --"] + etiquetas_clientes
 
 # Selectbox final (ya filtrado)
 seleccion = st.selectbox("Coincidencias", opciones, key="coincidencia_cliente")
-cliente_sel = mapa_clientes.get(seleccion)
+cliente_sel = None
+if seleccion in etiqueta_a_id:
+    cliente_sel = get_client(etiqueta_a_id[seleccion])
+
+# Aviso de posible cliente repetido (del último guardado)
+if st.session_state.get("aviso_duplicado"):
+    nuevo_id, parecidos = st.session_state["aviso_duplicado"]
+    st.warning(
+        "⚠️ El cliente que acabas de guardar se parece a clientes que ya "
+        "existían. Si es el mismo, únelo para no repetirlo:"
+    )
+    for parecido_id, etiqueta_parecido, telefono_parecido, motivo in parecidos:
+        col_av1, col_av2 = st.columns([3, 1])
+        with col_av1:
+            st.write(f"**#{parecido_id} {etiqueta_parecido}** · {telefono_parecido or ''} · {motivo}")
+        with col_av2:
+            if st.button("🔗 Unir con este", key=f"unir_aviso_{nuevo_id}_{parecido_id}"):
+                fx_db.merge_clients(parecido_id, [nuevo_id], branch=sucursal)
+                st.session_state["aviso_duplicado"] = None
+                st.rerun()
+    if st.button("Es otro cliente, ignorar aviso"):
+        st.session_state["aviso_duplicado"] = None
+        st.rerun()
 
 with st.form("form_servicio_cliente", clear_on_submit=True):
     col1, col2, col3 = st.columns(3)
@@ -392,25 +322,25 @@ with st.form("form_servicio_cliente", clear_on_submit=True):
     with col1:
         name = st.text_input(
             "Nombre de la persona / contacto",
-            value=cliente_sel["name"] if cliente_sel else "",
+            value=cliente_sel.name if cliente_sel else "",
         )
         business_name = st.text_input(
             "Nombre del negocio",
-            value=cliente_sel["business_name"] if cliente_sel else "",
+            value=cliente_sel.business_name if cliente_sel else "",
         )
 
     with col2:
         phone = st.text_input(
             "Teléfono",
-            value=cliente_sel["phone"] if cliente_sel else "",
+            value=cliente_sel.phone if cliente_sel else "",
         )
         zone = st.text_input(
             "Colonia / zona",
-            value=cliente_sel["zone"] if cliente_sel else "",
+            value=cliente_sel.zone if cliente_sel else "",
         )
         address = st.text_input(
             "Dirección",
-            value=cliente_sel["address"] if cliente_sel else "",
+            value=cliente_sel.address if cliente_sel else "",
         )
 
     with col3:
@@ -422,6 +352,7 @@ with st.form("form_servicio_cliente", clear_on_submit=True):
             "Estado del servicio",
             ["Pendiente", "Confirmado", "Realizado", "Cobrado"],
         )
+        crew = st.text_input("Cuadrilla (opcional)")
 
     # Estos siempre empiezan en blanco aunque el cliente exista
     pest_type = st.text_input("Tipo de plaga (cucaracha, garrapata, termita, etc.)")
@@ -438,8 +369,13 @@ with st.form("form_servicio_cliente", clear_on_submit=True):
             st.error("Pon al menos el nombre de la persona o del negocio.")
         else:
             # Si es cliente NUEVO (no seleccionado en "Buscar cliente") → guardar cliente
+            client_id = etiqueta_a_id.get(seleccion)
             if seleccion == "-- Cliente nuevo --":
-                add_client(
+                parecidos = fx_db.find_client_candidates(
+                    name, business_name, phone, branch=sucursal
+                )
+
+                client_id = add_client(
                     name=name or (business_name or "Cliente sin nombre"),
                     business_name=business_name,
                     address=address,
@@ -465,8 +401,14 @@ with st.form("form_servicio_cliente", clear_on_submit=True):
                 status=status,
                 notes=notes,
                 is_monthly_service=is_monthly_service,
+                crew=crew.strip(),
+                client_id=client_id,
             )
 
+            # El aviso se muestra después del rerun, arriba del formulario
+            if seleccion == "-- Cliente nuevo --" and parecidos:
+                st.session_state["aviso_duplicado"] = (client_id, parecidos)
+
             st.success(
                 "✅ Servicio agendado."
                 + (" Cliente guardado." if seleccion == "-- Cliente nuevo --" else "")
@@ -476,11 +418,7 @@ with st.form("form_servicio_cliente", clear_on_submit=True):
 # =========================
 # TABLA SERVICIOS MENSUALES (EN EXPANDER)
 # =========================
-todos_servicios = get_appointments()
-servicios_mensuales = [
-    r for r in todos_servicios
-    if "is_monthly_service" in r.keys() and r["is_monthly_service"] == 1
-]
+servicios_mensuales = fx_db.AppointmentQuery(sucursal).monthly(True).fetch()
 
 with st.expander("📌 Servicios marcados como mensuales", expanded=False):
     if not servicios_mensuales:
@@ -488,23 +426,248 @@ with st.expander("📌 Servicios marcados como mensuales", expanded=False):
     else:
         tabla_mensuales = [
             {
-                "ID": r["id"],
-        "Fecha": r["date"],
-        "Hora": r["time"],
-        "Cliente/Negocio": r["client_name"],
-        "Tipo servicio": r["service_type"],
-        "Plaga": r["pest_type"],
-        "Zona": r["zone"],
-        "Dirección": r["address"],
-        "Teléfono": r["phone"],
-        "Precio": r["price"],
-        "Estado": r["status"],
-        "Notas": r["notes"],
+                "ID": r.id,
+        "Fecha": r.date,
+        "Hora": r.time_str,
+        "Cliente/Negocio": r.client_name,
+        "Tipo servicio": r.service_type,
+        "Plaga": r.pest_type,
+        "Zona": r.zone,
+        "Dirección": r.address,
+        "Teléfono": r.phone,
+        "Precio": r.price,
+        "Estado": r.status,
+        "Notas": r.notes,
             }
             for r in servicios_mensuales
         ]
         st.dataframe(tabla_mensuales, use_container_width=True)
 
+# =========================
+# GENERAR SERVICIOS MENSUALES
+# =========================
+with st.expander("🔁 Generar visitas mensuales", expanded=False):
+    st.caption(
+        "Agenda de una vez las visitas del mes de los clientes mensuales y de los "
+        "servicios marcados como mensuales. Se puede repetir sin duplicar nada."
+    )
+
+    meses_generar = []
+    anio_mes = (hoy.year, hoy.month)
+    for _ in range(3):
+        meses_generar.append(anio_mes)
+        anio_mes = recurrence.next_month(date(anio_mes[0], anio_mes[1], 1))
+    mes_generar = st.selectbox(
+        "Mes",
+        meses_generar,
+        index=1,
+        format_func=lambda m: f"{m[1]:02d}/{m[0]}",
+        key="mes_recurrencia",
+    )
+
+    if st.button(f"🔁 Generar visitas de {mes_generar[1]:02d}/{mes_generar[0]}"):
+        creadas = fx_db.generate_visits(*mes_generar, branch=sucursal)
+        st.success(f"✅ {creadas} visita(s) agendada(s).")
+
+    # Solo se recalcula si cambió algo en la agenda
+    proximas = get_recurrence_preview(sucursal, fx_db.get_data_version(sucursal), hoy)
+    if proximas:
+        st.markdown("**Próximas visitas por generar** (máx. 50)")
+        st.dataframe(
+            [
+                {
+                    "Fecha": o.date,
+                    "Hora": o.time,
+                    "Cliente/Negocio": o.client_name,
+                    "Plaga": o.pest_type,
+                    "Zona": o.zone,
+                    "Precio": o.price,
+                    "Cuadrilla": o.crew,
+                }
+                for o in proximas
+            ],
+            use_container_width=True,
+        )
+    else:
+        st.info("No hay visitas mensuales pendientes de generar.")
+
+# =========================
+# CALENDARIO (MES / SEMANA)
+# =========================
+with st.expander("🗓️ Calendario de servicios", expanded=False):
+    col_cal1, col_cal2 = st.columns([1, 2])
+
+    with col_cal1:
+        fecha_calendario = st.date_input(
+            "Mes / semana a mostrar",
+            value=hoy,
+            key="fecha_calendario",
+        )
+    with col_cal2:
+        vista_calendario = st.radio(
+            "Vista",
+            ["Mes", "Semana"],
+            horizontal=True,
+            key="vista_calendario",
+        )
+
+    if vista_calendario == "Mes":
+        semanas = calendar.Calendar(firstweekday=0).monthdatescalendar(
+            fecha_calendario.year, fecha_calendario.month
+        )
+    else:
+        lunes_cal = fecha_calendario - timedelta(days=fecha_calendario.weekday())
+        semanas = [[lunes_cal + timedelta(days=i) for i in range(7)]]
+
+    # Una sola consulta agrupada para todo lo que se ve en pantalla
+    if vista_consolidada:
+        resumen_cal = fx_db.get_calendar_summary_all_branches(
+            str(semanas[0][0]), str(semanas[-1][-1])
+        )
+    else:
+        resumen_cal = get_calendar_summary(str(semanas[0][0]), str(semanas[-1][-1]))
+
+    if vista_calendario == "Mes":
+        total_mes = sum(
+            r["total"] for d, r in resumen_cal.items()
+            if d[:7] == fecha_calendario.strftime("%Y-%m")
+        )
+        ingresos_mes = sum(
+            r["ingresos"] for d, r in resumen_cal.items()
+            if d[:7] == fecha_calendario.strftime("%Y-%m")
+        )
+        st.markdown(f"**{total_mes}** servicios en el mes · **${ingresos_mes:,.2f}**")
+
+    cols_dias = st.columns(7)
+    for i, nombre_dia in enumerate(DIAS_SEMANA):
+        cols_dias[i].markdown(f"**{nombre_dia}**")
+
+    for semana in semanas:
+        cols_dias = st.columns(7)
+        for i, dia in enumerate(semana):
+            with cols_dias[i]:
+                if vista_calendario == "Mes" and dia.month != fecha_calendario.month:
+                    st.write("")
+                    continue
+
+                r = resumen_cal.get(str(dia))
+                etiqueta_dia = f"{dia.day}" + (" 📍" if dia == hoy else "")
+                if r:
+                    etiqueta_dia += f" · {r['total']} serv."
+
+                if st.button(etiqueta_dia, key=f"cal_dia_{dia}", use_container_width=True):
+                    st.session_state["dia_calendario"] = str(dia)
+
+                if r:
+                    st.caption(
+                        f"${r['ingresos']:,.0f} · P{r['pendientes']} C{r['confirmados']} "
+                        f"R{r['realizados']} Cob{r['cobrados']}"
+                    )
+
+    # Detalle del día: solo se consulta cuando se da clic en el día
+    dia_calendario = st.session_state.get("dia_calendario")
+    if dia_calendario:
+        st.markdown(f"#### Servicios del {dt.fromisoformat(dia_calendario).strftime('%d/%m/%Y')}")
+        if vista_consolidada:
+            rows_dia = fx_db.get_appointments_all_branches(
+                date_from=dia_calendario, date_to=dia_calendario
+            )
+        else:
+            rows_dia = get_appointments(date_from=dia_calendario, date_to=dia_calendario)
+        if not rows_dia:
+            st.info("No hay servicios ese día.")
+        else:
+            st.dataframe(
+                [
+                    {
+                        "ID": r.id,
+                        "Hora": r.time_str,
+                        "Cliente/Negocio": r.client_name,
+                        "Plaga": r.pest_type,
+                        "Zona": r.zone,
+                        "Dirección": r.address,
+                        "Precio": r.price,
+                        "Estado": r.status,
+                    }
+                    for r in rows_dia
+                ],
+                use_container_width=True,
+            )
+
+# =========================
+# RUTA DEL DÍA POR CUADRILLA
+# =========================
+with st.expander("🚚 Ruta del día por cuadrilla", expanded=False):
+    col_r1, col_r2 = st.columns(2)
+
+    with col_r1:
+        fecha_ruta = st.date_input("Día de la ruta", value=hoy, key="fecha_ruta")
+    with col_r2:
+        crews_dia = get_crews(str(fecha_ruta))
+        crew_ruta = st.selectbox(
+            "Cuadrilla",
+            crews_dia,
+            format_func=lambda x: x or "Sin cuadrilla",
+            key="crew_ruta",
+        )
+
+    visitas_ruta = get_crew_day(str(fecha_ruta), crew_ruta) if crews_dia else []
+
+    if not visitas_ruta:
+        st.info("No hay servicios ese día.")
+    else:
+        coords_zonas = fx_db.get_zone_coords(sucursal)
+
+        # Por defecto respetamos la hora de los servicios confirmados
+        fijos_ruta = st.multiselect(
+            "Servicios con hora fija",
+            [r.id for r in visitas_ruta],
+            default=[r.id for r in visitas_ruta if r.status == "Confirmado"],
+            format_func=lambda i: next(
+                f"{r.time_str} · {r.client_name}" for r in visitas_ruta if r.id == i
+            ),
+            key=f"fijos_ruta_{fecha_ruta}_{crew_ruta}",
+        )
+
+        ordenadas, km_tramos, km_total, km_original = routes.plan_route(
+            visitas_ruta, coords_zonas, fijos=fijos_ruta
+        )
+
+        st.dataframe(
+            [
+                {
+                    "Orden": i + 1,
+                    "Hora agendada": r.time_str,
+                    "Cliente/Negocio": r.client_name,
+                    "Zona": r.zone,
+                    "Dirección": r.address,
+                    "Hora fija": "📌" if r.id in fijos_ruta else "",
+                    "Km desde anterior": round(km, 1),
+                }
+                for i, (r, km) in enumerate(zip(ordenadas, km_tramos))
+            ],
+            use_container_width=True,
+        )
+        if km_original:
+            st.caption(
+                f"Recorrido estimado: **{km_total:.1f} km** "
+                f"(por hora agendada serían {km_original:.1f} km)"
+            )
+
+        sin_zona = [
+            r.zone or "(sin zona)" for r in visitas_ruta
+            if routes.normalize_zone(r.zone) not in coords_zonas
+        ]
+        if sin_zona:
+            st.warning(
+                "Sin coordenadas (van al final): " + ", ".join(sorted(set(sin_zona)))
+                + f". Agrégalas en {routes.ZONES_CSV}."
+            )
+
+    if st.button("🔄 Recargar coordenadas de zonas"):
+        cargadas = fx_db.reload_zone_coords(sucursal)
+        st.success(f"Se cargaron {cargadas} zonas desde {routes.ZONES_CSV}.")
+
 # =========================
 # SERVICIOS AGENDADOS (EN EXPANDER)
 # =========================
@@ -521,18 +684,13 @@ with st.expander("📅 Servicios agendados", expanded=False):
     lunes_semana = fecha_semana - timedelta(days=fecha_semana.weekday())
     domingo_semana = lunes_semana + timedelta(days=6)
 
-    st.info(
-        f"Mostrando servicios del **{lunes_semana.strftime('%d/%m/%Y')}** "
-        f"al **{domingo_semana.strftime('%d/%m/%Y')}**"
-    )
-    
     col_f1, col_f2, col_f3 = st.columns(3)
 
     with col_f1:
         filtro_rango = st.selectbox(
             "Rango de fechas",
-            ["Hoy", "Próximos 7 días", "Todos"],
-            index=1,
+            ["Hoy", "Próximos 7 días", "Semana seleccionada", "Todos"],
+            index=2,
             key="filtro_rango_serv",
         )
 
@@ -545,11 +703,15 @@ with st.expander("📅 Servicios agendados", expanded=False):
         )
 
     with col_f3:
-        st.write("")  # espacio
-        st.write("")
+        filtro_texto = st.text_input(
+            "Buscar (cliente, zona, dirección, notas...)",
+            key="filtro_texto_serv",
+        )
 
-    date_from = str(lunes_semana)
-    date_to = str(domingo_semana)
+    # Cada opción usa SU rango (antes "Próximos 7 días" y "Todos"
+    # terminaban mostrando la semana seleccionada)
+    date_from = None
+    date_to = None
 
     if filtro_rango == "Hoy":
         date_from = str(hoy)
@@ -557,213 +719,339 @@ with st.expander("📅 Servicios agendados", expanded=False):
     elif filtro_rango == "Próximos 7 días":
         date_from = str(hoy)
         date_to = str(hoy + timedelta(days=7))
-        
+    elif filtro_rango == "Semana seleccionada":
         date_from = str(lunes_semana)
         date_to = str(domingo_semana)
 
-    rows = get_appointments(date_from=date_from, date_to=date_to, status=filtro_estado)
+    if date_from:
+        st.info(
+            f"Mostrando servicios del **{dt.fromisoformat(date_from).strftime('%d/%m/%Y')}** "
+            f"al **{dt.fromisoformat(date_to).strftime('%d/%m/%Y')}**"
+        )
+    else:
+        st.info("Mostrando **todos** los servicios.")
+
+    if vista_consolidada:
+        rows = fx_db.get_appointments_all_branches(
+            date_from=date_from, date_to=date_to, status=filtro_estado,
+            text=filtro_texto,
+        )
+    else:
+        rows = (
+            fx_db.AppointmentQuery(sucursal)
+            .date_range(date_from, date_to)
+            .status(filtro_estado)
+            .text(filtro_texto)
+            .fetch()
+        )
 
     if not rows:
         st.info("No hay servicios con los filtros seleccionados.")
     else:
         data = [
             {
-                "ID": r["id"],
-        "Fecha": r["date"],
-        "Hora": r["time"],
-        "Cliente/Negocio": r["client_name"],
-        "Tipo servicio": r["service_type"],
-        "Plaga": r["pest_type"],
-        "Zona": r["zone"],
-        "Dirección": r["address"],
-        "Teléfono": r["phone"],
-        "Precio": r["price"],
-        "Estado": r["status"],
-        "Notas": r["notes"],
+                "ID": r.id,
+        "Fecha": r.date,
+        "Hora": r.time_str,
+        "Cliente/Negocio": r.client_name,
+        "Tipo servicio": r.service_type,
+        "Plaga": r.pest_type,
+        "Zona": r.zone,
+        "Dirección": r.address,
+        "Teléfono": r.phone,
+        "Precio": r.price,
+        "Estado": r.status,
+        "Cuadrilla": r.crew,
+        "Notas": r.notes,
             }
             for r in rows
         ]
+        if vista_consolidada:
+            for fila, r in zip(data, rows):
+                fila["Sucursal"] = r.branch
 
-        st.dataframe(data, use_container_width=True)
-
-        st.markdown("---")
-        st.subheader("Buscar / editar servicio")
-
-        # -------- BUSCAR SERVICIO POR ID O NOMBRE --------
-        col_bs1, col_bs2, col_bs3 = st.columns([2, 2, 1])
-
-        with col_bs1:
-            opciones_ids_serv = ["--"] + [str(r["id"]) for r in rows]
-            servicio_id_sel = st.selectbox("Buscar por ID de servicio", opciones_ids_serv)
-
-        with col_bs2:
-            opciones_nombres_serv = ["--"]
-            etiqueta_a_servicio = {}
-            for r in rows:
-                etiqueta = f"{r['client_name']} ({r['date']} {r['time']})"
-                opciones_nombres_serv.append(etiqueta)
-                etiqueta_a_servicio[etiqueta] = r
-            servicio_nombre_sel = st.selectbox("Buscar por cliente / negocio", opciones_nombres_serv)
-
-        with col_bs3:
-            buscar_servicio_btn = st.button("🔍 Buscar servicio")
-
-        if buscar_servicio_btn:
-            servicio_id = None
-
-            # Preferimos búsqueda por ID si se eligió
-            if servicio_id_sel != "--":
-                try:
-                    sid = int(servicio_id_sel)
-                    for r in rows:
-                        if r["id"] == sid:
-                            servicio_id = r["id"]
-                            break
-                except ValueError:
-                    servicio_id = None
-            elif servicio_nombre_sel != "--":
-                servicio = etiqueta_a_servicio.get(servicio_nombre_sel)
-                if servicio:
-                    servicio_id = servicio["id"]
-
-            if servicio_id is None:
-                st.error("No se encontró el servicio con los datos seleccionados.")
-                st.session_state["servicio_edit_id"] = None
-            else:
-                st.session_state["servicio_edit_id"] = servicio_id
-
-        servicio_edit_id = st.session_state.get("servicio_edit_id")
-
-        # -------- EDITAR / ELIMINAR SERVICIO (solo si se buscó) --------
-        if servicio_edit_id:
-            selected_row = None
-            for r in rows:
-                if r["id"] == servicio_edit_id:
-                    selected_row = r
-                    break
-
-            if selected_row:
-                st.markdown("### ✏️ Editar servicio seleccionado")
-
-                # Convertir fecha y hora desde texto
-                try:
-                    fecha_edit = dt.fromisoformat(selected_row["date"]).date()
-                except Exception:
+            st.dataframe(data, use_container_width=True)
+            st.info("Vista consolidada de solo lectura. Para editar un servicio elige su sucursal.")
+        else:
+            # -------- TABLA EDITABLE + CAMBIO DE ESTADO EN BLOQUE --------
+            # Se editan las celdas directo en la tabla y se marcan filas con
+            # "Sel." para cambiarles el estado a todas juntas. Al guardar solo
+            # se escriben las celdas que cambiaron, en una sola transacción.
+            for fila in data:
+                fila["Sel."] = False
+
+            version_tabla = st.session_state.get("version_tabla_serv", 0)
+            editada = st.data_editor(
+                data,
+                use_container_width=True,
+                hide_index=True,
+                column_order=["Sel."] + [col for col in data[0] if col != "Sel."],
+                disabled=["ID", "Fecha", "Hora", "Tipo servicio"],
+                column_config={
+                    "Sel.": st.column_config.CheckboxColumn("Sel.", width="small"),
+                    "Estado": st.column_config.SelectboxColumn(
+                        "Estado",
+                        options=["Pendiente", "Confirmado", "Realizado", "Cobrado"],
+                    ),
+                    "Precio": st.column_config.NumberColumn("Precio", min_value=0.0, step=50.0),
+                },
+                key=f"tabla_serv_{version_tabla}",
+            )
+            if hasattr(editada, "to_dict"):
+                editada = editada.to_dict("records")
+
+            col_bl1, col_bl2 = st.columns([2, 1])
+            with col_bl1:
+                estado_bloque = st.selectbox(
+                    "Cambiar estado de los seleccionados a",
+                    ["-- Sin cambio --", "Pendiente", "Confirmado", "Realizado", "Cobrado"],
+                    key="estado_bloque_serv",
+                )
+            with col_bl2:
+                st.write("")
+                guardar_tabla = st.button("💾 Guardar cambios de la tabla")
+
+            if guardar_tabla:
+                cambios = fx_db.diff_appointment_rows(data, editada, COLUMNAS_TABLA_SERV)
+                if estado_bloque != "-- Sin cambio --":
+                    seleccionados = [int(f["ID"]) for f in editada if f.get("Sel.")]
+                    # El estado en bloque manda sobre lo que se haya tecleado
+                    cambios["status"] = [
+                        (v, i) for v, i in cambios.get("status", []) if i not in seleccionados
+                    ] + [(estado_bloque, i) for i in seleccionados]
+                    if not cambios["status"]:
+                        del cambios["status"]
+
+                if not cambios:
+                    st.info("No hay cambios que guardar.")
+                else:
+                    total = fx_db.update_appointments_cells(cambios, branch=sucursal)
+                    st.session_state["version_tabla_serv"] = version_tabla + 1
+                    st.success(f"✅ {total} cambio(s) guardado(s).")
+                    st.rerun()
+
+            st.markdown("---")
+            st.subheader("Buscar / editar servicio")
+
+            # -------- BUSCAR SERVICIO POR ID O NOMBRE --------
+            col_bs1, col_bs2, col_bs3 = st.columns([2, 2, 1])
+
+            with col_bs1:
+                opciones_ids_serv = ["--"] + [str(r.id) for r in rows]
+                servicio_id_sel = st.selectbox("Buscar por ID de servicio", opciones_ids_serv)
+
+            with col_bs2:
+                opciones_nombres_serv = ["--"]
+                etiqueta_a_servicio = {}
+                for r in rows:
+                    etiqueta = f"{r.client_name} ({r.date} {r.time_str})"
+                    opciones_nombres_serv.append(etiqueta)
+                    etiqueta_a_servicio[etiqueta] = r
+                servicio_nombre_sel = st.selectbox("Buscar por cliente / negocio", opciones_nombres_serv)
+
+            with col_bs3:
+                buscar_servicio_btn = st.button("🔍 Buscar servicio")
+
+            if buscar_servicio_btn:
+                servicio_id = None
+
+                # Preferimos búsqueda por ID si se eligió
+                if servicio_id_sel != "--":
                     try:
-                        fecha_edit = dt.strptime(selected_row["date"], "%Y-%m-%d").date()
-                    except Exception:
-                        fecha_edit = hoy
-
-                try:
-                    hora_edit = dt.strptime(selected_row["time"], "%H:%M").time()
-                except Exception:
-                    hora_edit = dt.now().time()
-
-                is_monthly_service_current = False
-                if "is_monthly_service" in selected_row.keys() and selected_row["is_monthly_service"] == 1:
-                    is_monthly_service_current = True
-
-                with st.form("form_editar_servicio"):
-                    col_e1, col_e2, col_e3 = st.columns(3)
-
-                    with col_e1:
-                        client_name_edit = st.text_input(
-                            "Cliente / Negocio",
-                            value=selected_row["client_name"],
-                        )
-                        pest_type_edit = st.text_input(
-                            "Tipo de plaga",
-                            value=selected_row["pest_type"] or "",
+                        servicio = fx_db.get_appointment(int(servicio_id_sel), branch=sucursal)
+                        servicio_id = servicio.id if servicio else None
+                    except ValueError:
+                        servicio_id = None
+                elif servicio_nombre_sel != "--":
+                    servicio = etiqueta_a_servicio.get(servicio_nombre_sel)
+                    if servicio:
+                        servicio_id = servicio.id
+
+                if servicio_id is None:
+                    st.error("No se encontró el servicio con los datos seleccionados.")
+                    st.session_state["servicio_edit_id"] = None
+                else:
+                    st.session_state["servicio_edit_id"] = servicio_id
+
+            servicio_edit_id = st.session_state.get("servicio_edit_id")
+
+            # -------- EDITAR / ELIMINAR SERVICIO (solo si se buscó) --------
+            if servicio_edit_id:
+                selected_row = fx_db.get_appointment(servicio_edit_id, branch=sucursal)
+
+                if selected_row:
+                    st.markdown("### ✏️ Editar servicio seleccionado")
+
+                    # La fecha y hora ya vienen convertidas desde la BD
+                    fecha_edit = selected_row.date or hoy
+                    hora_edit = selected_row.time or dt.now().time()
+                    is_monthly_service_current = selected_row.is_monthly_service
+
+                    with st.form("form_editar_servicio"):
+                        col_e1, col_e2, col_e3 = st.columns(3)
+
+                        with col_e1:
+                            client_name_edit = st.text_input(
+                                "Cliente / Negocio",
+                                value=selected_row.client_name,
+                            )
+                            pest_type_edit = st.text_input(
+                                "Tipo de plaga",
+                                value=selected_row.pest_type or "",
+                            )
+
+                        with col_e2:
+                            zone_edit = st.text_input(
+                                "Colonia / zona",
+                                value=selected_row.zone or "",
+                            )
+                            address_edit = st.text_input(
+                                "Dirección",
+                                value=selected_row.address or "",
+                            )
+                            phone_edit = st.text_input(
+                                "Teléfono",
+                                value=selected_row.phone or "",
+                            )
+
+                        with col_e3:
+                            service_date_edit = st.date_input(
+                                "Fecha del servicio (editar)",
+                                value=fecha_edit,
+                                key="fecha_edit",
+                            )
+                            service_time_edit = st.time_input(
+                                "Hora del servicio (editar)",
+                                value=hora_edit,
+                                key="hora_edit",
+                            )
+                            price_edit = st.number_input(
+                                "Precio ($) (editar)",
+                                min_value=0.0,
+                                step=50.0,
+                                value=float(selected_row.price) if selected_row.price is not None else 0.0,
+                                key="price_edit",
+                            )
+                            status_edit = st.selectbox(
+                                "Estado (editar)",
+                                ["Pendiente", "Confirmado", "Realizado", "Cobrado"],
+                                index=["Pendiente", "Confirmado", "Realizado", "Cobrado"].index(selected_row.status) if selected_row.status in ["Pendiente", "Confirmado", "Realizado", "Cobrado"] else 0,
+                                key="status_edit",
+                            )
+                            crew_edit = st.text_input(
+                                "Cuadrilla (editar)",
+                                value=selected_row.crew or "",
+                                key="crew_edit",
+                            )
+
+                        notes_edit = st.text_area(
+                            "Notas (editar)",
+                            value=selected_row.notes or "",
                         )
 
-                    with col_e2:
-                        zone_edit = st.text_input(
-                            "Colonia / zona",
-                            value=selected_row["zone"] or "",
-                        )
-                        address_edit = st.text_input(
-                            "Dirección",
-                            value=selected_row["address"] or "",
-                        )
-                        phone_edit = st.text_input(
-                            "Teléfono",
-                            value=selected_row["phone"] or "",
+                        is_monthly_service_edit = st.checkbox(
+                            "Servicio mensual (editar)",
+                            value=is_monthly_service_current,
                         )
 
-                    with col_e3:
-                        service_date_edit = st.date_input(
-                            "Fecha del servicio (editar)",
-                            value=fecha_edit,
-                            key="fecha_edit",
-                        )
-                        service_time_edit = st.time_input(
-                            "Hora del servicio (editar)",
-                            value=hora_edit,
-                            key="hora_edit",
-                        )
-                        price_edit = st.number_input(
-                            "Precio ($) (editar)",
-                            min_value=0.0,
-                            step=50.0,
-                            value=float(selected_row["price"]) if selected_row["price"] is not None else 0.0,
-                            key="price_edit",
-                        )
-                        status_edit = st.selectbox(
-                            "Estado (editar)",
-                            ["Pendiente", "Confirmado", "Realizado", "Cobrado"],
-                            index=["Pendiente", "Confirmado", "Realizado", "Cobrado"].index(selected_row["status"]) if selected_row["status"] in ["Pendiente", "Confirmado", "Realizado", "Cobrado"] else 0,
-                            key="status_edit",
+                        confirmar_eliminar_serv = st.checkbox(
+                            "✅ Confirmar eliminación de este servicio",
+                            key=f"confirm_del_serv_{servicio_edit_id}",
                         )
 
-                    notes_edit = st.text_area(
-                        "Notas (editar)",
-                        value=selected_row["notes"] or "",
-                    )
+                        col_btn_s1, col_btn_s2 = st.columns(2)
+                        with col_btn_s1:
+                            guardar_cambios_serv = st.form_submit_button("💾 Guardar cambios del servicio")
+                        with col_btn_s2:
+                            eliminar_servicio_btn = st.form_submit_button("🗑️ Eliminar servicio")
+
+                        if guardar_cambios_serv:
+                            update_appointment_full(
+                                appointment_id=servicio_edit_id,
+                                client_name=client_name_edit,
+                                service_type=selected_row.service_type,
+                                pest_type=pest_type_edit,
+                                address=address_edit,
+                                zone=zone_edit,
+                                phone=phone_edit,
+                                fecha=str(service_date_edit),
+                                hora=str(service_time_edit)[:5],
+                                price=price_edit if price_edit > 0 else None,
+                                status=status_edit,
+                                notes=notes_edit,
+                                is_monthly_service=is_monthly_service_edit,
+                                crew=crew_edit.strip(),
+                            )
+                            st.success("✅ Servicio actualizado correctamente.")
+                            st.session_state["servicio_edit_id"] = None
+                            st.rerun()
 
-                    is_monthly_service_edit = st.checkbox(
-                        "Servicio mensual (editar)",
-                        value=is_monthly_service_current,
-                    )
+                        if eliminar_servicio_btn:
+                            if confirmar_eliminar_serv:
+                                delete_appointment(servicio_edit_id)
+                                st.warning("🗑️ Servicio eliminado correctamente.")
+                                st.session_state["servicio_edit_id"] = None
+                                st.rerun()
+                            else:
+                                st.warning("Marca la casilla 'Confirmar eliminación de este servicio' para eliminar.")
 
-                    confirmar_eliminar_serv = st.checkbox(
-                        "✅ Confirmar eliminación de este servicio",
-                        key=f"confirm_del_serv_{servicio_edit_id}",
-                    )
+# =========================
+# PRONÓSTICO DE INGRESOS
+# =========================
+with st.expander("📈 Pronóstico de ingresos y carga de trabajo", expanded=False):
+    semanas_pron = st.selectbox(
+        "Semanas", [4, 8, 12, 26], index=1, key="semanas_pronostico",
+    )
+    pron = get_forecast(
+        sucursal, fx_db.get_data_version(sucursal), semanas_pron, hoy,
+    )
+    st.caption(
+        "Servicios agendados más visitas mensuales por generar, cada uno "
+        "ponderado por la probabilidad de hacerse según su estado "
+        f"(Pendiente {pron.rates['Pendiente']:.0%}, "
+        f"Confirmado {pron.rates['Confirmado']:.0%}, último año)."
+    )
 
-                    col_btn_s1, col_btn_s2 = st.columns(2)
-                    with col_btn_s1:
-                        guardar_cambios_serv = st.form_submit_button("💾 Guardar cambios del servicio")
-                    with col_btn_s2:
-                        eliminar_servicio_btn = st.form_submit_button("🗑️ Eliminar servicio")
-
-                    if guardar_cambios_serv:
-                        update_appointment_full(
-                            appointment_id=servicio_edit_id,
-                            client_name=client_name_edit,
-                            service_type=selected_row["service_type"],
-                            pest_type=pest_type_edit,
-                            address=address_edit,
-                            zone=zone_edit,
-                            phone=phone_edit,
-                            fecha=str(service_date_edit),
-                            hora=str(service_time_edit)[:5],
-                            price=price_edit if price_edit > 0 else None,
-                            status=status_edit,
-                            notes=notes_edit,
-                            is_monthly_service=is_monthly_service_edit,
-                        )
-                        st.success("✅ Servicio actualizado correctamente.")
-                        st.session_state["servicio_edit_id"] = None
-                        st.rerun()
+    col_p1, col_p2, col_p3 = st.columns(3)
+    col_p1.metric("Ingreso esperado", f"${pron.revenue_day.sum():,.0f}")
+    col_p2.metric("Visitas esperadas", f"{pron.visits_day.sum():,.0f}")
+    col_p3.metric("Servicios considerados", f"{pron.scheduled + pron.recurring}",
+                  help=f"{pron.recurring} de contratos mensuales")
 
-                    if eliminar_servicio_btn:
-                        if confirmar_eliminar_serv:
-                            delete_appointment(servicio_edit_id)
-                            st.warning("🗑️ Servicio eliminado correctamente.")
-                            st.session_state["servicio_edit_id"] = None
-                            st.rerun()
-                        else:
-                            st.warning("Marca la casilla 'Confirmar eliminación de este servicio' para eliminar.")
+    semanas_etq = [f"{s:%d/%m}" for s in pron.week_starts()]
+    if pron.zones:
+        st.markdown("**Ingreso esperado por semana y zona**")
+        st.bar_chart(
+            {
+                # Fechas (no texto) para que el eje quede en orden cronológico
+                "Semana": pron.week_starts(),
+                **{z: pron.revenue_zone_week[i] for i, z in enumerate(pron.zones)},
+            },
+            x="Semana",
+        )
+        st.markdown("**Visitas esperadas por día**")
+        st.line_chart(
+            {
+                "Día": [hoy + timedelta(days=i) for i in range(len(pron.visits_day))],
+                "Visitas": pron.visits_day,
+            },
+            x="Día",
+        )
+        st.dataframe(
+            [
+                {
+                    "Zona": z,
+                    **{
+                        etq: round(float(v), 2)
+                        for etq, v in zip(semanas_etq, pron.revenue_zone_week[i])
+                    },
+                }
+                for i, z in enumerate(pron.zones)
+            ],
+            use_container_width=True,
+        )
+    else:
+        st.info("No hay servicios agendados ni visitas mensuales en este periodo.")
 
 # =========================
 # BUSCAR Y EDITAR CLIENTE
@@ -771,26 +1059,17 @@ with st.expander("📅 Servicios agendados", expanded=False):
 st.markdown("---")
 st.subheader("Buscar y editar cliente")
 
-clientes_all = get_clients()
-
-if not clientes_all:
+if not etiquetas_clientes:
     st.info("Aún no tienes clientes guardados.")
 else:
     col_c1, col_c2, col_c3 = st.columns([2, 2, 1])
 
     with col_c1:
-        opciones_ids = ["--"] + [str(c["id"]) for c in clientes_all]
+        opciones_ids = ["--"] + [str(etiqueta_a_id[e]) for e in etiquetas_clientes]
         cliente_id_sel = st.selectbox("Buscar por ID de cliente", opciones_ids)
 
     with col_c2:
-        opciones_nombres = ["--"]
-        etiqueta_a_cliente = {}
-        for c in clientes_all:
-            etiqueta = c["business_name"] or c["name"]
-            if c["business_name"] and c["name"]:
-                etiqueta = f"{c['business_name']} ({c['name']})"
-            opciones_nombres.append(etiqueta)
-            etiqueta_a_cliente[etiqueta] = c
+        opciones_nombres = ["--"] + etiquetas_clientes
         cliente_nombre_sel = st.selectbox("Buscar por nombre / negocio", opciones_nombres)
 
     with col_c3:
@@ -801,17 +1080,11 @@ else:
 
         if cliente_id_sel != "--":
             try:
-                cid = int(cliente_id_sel)
-                for c in clientes_all:
-                    if c["id"] == cid:
-                        cliente_id = c["id"]
-                        break
+                cliente_id = int(cliente_id_sel)
             except ValueError:
                 cliente_id = None
         elif cliente_nombre_sel != "--":
-            cliente = etiqueta_a_cliente.get(cliente_nombre_sel)
-            if cliente:
-                cliente_id = cliente["id"]
+            cliente_id = etiqueta_a_id.get(cliente_nombre_sel)
 
         if cliente_id is None:
             st.error("No se encontró el cliente con los datos seleccionados.")
@@ -822,11 +1095,7 @@ else:
     cliente_edit_id = st.session_state.get("cliente_edit_id")
 
     if cliente_edit_id:
-        cliente_encontrado = None
-        for c in clientes_all:
-            if c["id"] == cliente_edit_id:
-                cliente_encontrado = c
-                break
+        cliente_encontrado = get_client(cliente_edit_id)
 
         if cliente_encontrado:
             st.markdown("### ✏️ Editar datos del cliente")
@@ -834,28 +1103,43 @@ else:
             with st.form("form_editar_cliente"):
                 name_edit = st.text_input(
                     "Nombre de la persona / contacto",
-                    value=cliente_encontrado["name"] or "",
+                    value=cliente_encontrado.name or "",
                 )
                 business_name_edit = st.text_input(
                     "Nombre del negocio",
-                    value=cliente_encontrado["business_name"] or "",
+                    value=cliente_encontrado.business_name or "",
                 )
                 phone_edit = st.text_input(
                     "Teléfono",
-                    value=cliente_encontrado["phone"] or "",
+                    value=cliente_encontrado.phone or "",
                 )
                 zone_edit = st.text_input(
                     "Colonia / zona",
-                    value=cliente_encontrado["zone"] or "",
+                    value=cliente_encontrado.zone or "",
                 )
                 address_edit = st.text_input(
                     "Dirección",
-                    value=cliente_encontrado["address"] or "",
+                    value=cliente_encontrado.address or "",
                 )
                 notes_edit = st.text_area(
                     "Notas",
-                    value=cliente_encontrado["notes"] or "",
+                    value=cliente_encontrado.notes or "",
                 )
+                col_m1, col_m2 = st.columns(2)
+                with col_m1:
+                    is_monthly_edit = st.checkbox(
+                        "Cliente mensual (agendar cada mes)",
+                        value=cliente_encontrado.is_monthly,
+                    )
+                with col_m2:
+                    monthly_day_edit = st.number_input(
+                        "Día del mes de su visita",
+                        min_value=1,
+                        max_value=31,
+                        value=cliente_encontrado.monthly_day or 1,
+                        help="Si el mes es más corto se usa el último día; "
+                             "si cae en fin de semana, el lunes (o el viernes a fin de mes).",
+                    )
 
                 confirmar_eliminar_cliente = st.checkbox(
                     "✅ Confirmar eliminación de este cliente",
@@ -880,6 +1164,8 @@ else:
                             zone=zone_edit,
                             phone=phone_edit,
                             notes=notes_edit,
+                            is_monthly=is_monthly_edit,
+                            monthly_day=int(monthly_day_edit),
                         )
                         st.success("✅ Cliente actualizado correctamente.")
                         st.session_state["cliente_edit_id"] = None
@@ -894,6 +1180,91 @@ else:
                     else:
                         st.warning("Marca la casilla 'Confirmar eliminación de este cliente' para eliminar.")
 
+            # -------- HISTORIAL DEL CLIENTE --------
+            st.markdown("### 📋 Historial del cliente")
+            stats_cli = fx_db.get_client_stats(cliente_edit_id, hoy=hoy, branch=sucursal)
+
+            col_h1, col_h2, col_h3, col_h4, col_h5 = st.columns(5)
+            col_h1.metric("Visitas hechas", stats_cli.visits)
+            col_h2.metric("Total cobrado", f"${stats_cli.revenue:,.2f}")
+            col_h3.metric("Por cobrar (Realizado)", f"${stats_cli.outstanding:,.2f}")
+            col_h4.metric(
+                "Última visita",
+                stats_cli.last_visit.strftime("%d/%m/%Y") if stats_cli.last_visit else "—",
+            )
+            col_h5.metric(
+                "Próxima visita",
+                stats_cli.next_visit.strftime("%d/%m/%Y") if stats_cli.next_visit else "—",
+            )
+
+            if stats_cli.services:
+                por_pagina = 20
+                paginas = (stats_cli.services - 1) // por_pagina + 1
+                pagina = st.number_input(
+                    f"Página (de {paginas})",
+                    min_value=1,
+                    max_value=paginas,
+                    value=1,
+                    key=f"historial_pagina_{cliente_edit_id}",
+                )
+                historial = fx_db.get_client_history(
+                    cliente_edit_id, page=pagina - 1, page_size=por_pagina, branch=sucursal,
+                )
+                st.dataframe(
+                    [
+                        {
+                            "ID": r.id,
+                            "Fecha": r.date,
+                            "Hora": r.time_str,
+                            "Plaga": r.pest_type,
+                            "Precio": r.price,
+                            "Estado": r.status,
+                            "Cuadrilla": r.crew,
+                            "Notas": r.notes,
+                        }
+                        for r in historial
+                    ],
+                    use_container_width=True,
+                    hide_index=True,
+                )
+            else:
+                st.info("Este cliente todavía no tiene servicios registrados.")
+
+# =========================
+# CLIENTES DUPLICADOS
+# =========================
+with st.expander("🧹 Clientes duplicados", expanded=False):
+    grupos_dup = fx_db.find_duplicate_groups(sucursal)
+
+    if not grupos_dup:
+        st.info("No se encontraron clientes repetidos.")
+    else:
+        st.caption(
+            f"{len(grupos_dup)} grupo(s) con el mismo teléfono o un nombre igual/parecido. "
+            "Elige cuál se queda: sus servicios y datos faltantes se juntan ahí."
+        )
+        for grupo in grupos_dup[:20]:
+            miembros = [get_client(cid) for cid in grupo]
+            miembros = [m for m in miembros if m]
+            if len(miembros) < 2:
+                continue
+            quedarse = st.radio(
+                "Se queda",
+                [m.id for m in miembros],
+                format_func=lambda cid: next(
+                    f"#{m.id} {m.display_label or m.name} · {m.phone or 'sin teléfono'} · {m.zone or ''}"
+                    for m in miembros if m.id == cid
+                ),
+                key=f"dup_keep_{grupo[0]}",
+            )
+            if st.button("🔗 Unir este grupo", key=f"dup_unir_{grupo[0]}"):
+                movidos = fx_db.merge_clients(
+                    quedarse, [m.id for m in miembros if m.id != quedarse], branch=sucursal
+                )
+                st.success(f"✅ Clientes unidos. {movidos} servicio(s) reasignado(s).")
+                st.rerun()
+            st.markdown("---")
+
 # =========================
 # IMPORTAR / EXPORTAR BASE DE DATOS
 # =========================
@@ -901,39 +1272,84 @@ st.markdown("### 📦 Importar / Exportar base de datos")
 
 col_imp, col_exp, col_xls = st.columns(3)
 
+# Exportar y respaldar corre en segundo plano; la descarga aparece
+# en "Trabajos recientes" cuando el archivo está listo.
+
 # --- EXPORTAR BD (.db) ---
 with col_exp:
-    with open(DB_NAME, "rb") as f:
-        st.download_button(
-            label="⬇️ Exportar BD (.db)",
-            data=f,
-            file_name="agenda_respaldo.db",
-            mime="application/octet-stream",
-        )
+    if st.button("⬇️ Exportar BD (.db)"):
+        fx_db.submit_export(get_executor(), "backup", branch=sucursal)
+        st.toast("Respaldo en proceso…")
 
 # --- EXPORTAR A EXCEL (.xlsx) ---
 with col_xls:
     if st.button("📊 Exportar a Excel"):
-        conn = get_conn()
-
-        df_clients = pd.read_sql("SELECT * FROM clients", conn)
-        df_appointments = pd.read_sql("SELECT * FROM appointments", conn)
-
-        conn.close()
-
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine="openpyxl") as writer:
-            df_clients.to_excel(writer, sheet_name="Clientes", index=False)
-            df_appointments.to_excel(writer, sheet_name="Servicios", index=False)
+        fx_db.submit_export(get_executor(), "excel", branch=sucursal)
+        st.toast("Exportación a Excel en proceso…")
+
+    # --- EXPORTAR A PARQUET / ARROW (análisis) ---
+    formato_analisis = st.selectbox(
+        "Formato para análisis",
+        ["parquet", "arrow"],
+        format_func=lambda f: "Parquet" if f == "parquet" else "Arrow IPC",
+        key="formato_analisis",
+    )
+    solo_cambios = st.checkbox(
+        "Solo meses que cambiaron (incremental)",
+        value=True,
+        key="parquet_incremental",
+    )
+    if st.button("🗂️ Exportar para análisis"):
+        fx_db.submit_export(
+            get_executor(), "analysis", fmt=formato_analisis,
+            incremental=solo_cambios, branch=sucursal,
+        )
+        st.toast("Exportación para análisis en proceso…")
+
+
+@st.cache_resource(max_entries=5, show_spinner=False)
+def leer_archivo(path, mtime, size):
+    """
+    Bytes de un archivo terminado, para el botón de descarga.
+
+    El panel se redibuja cada 3 s; con la caché (llave: ruta, mtime y
+    tamaño) el archivo se lee del disco una sola vez. Es cache_resource y
+    no cache_data: todas las sesiones reciben el mismo objeto bytes en vez
+    de una copia nueva en cada redibujo.
+    """
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@st.fragment(run_every="3s")
+def panel_trabajos():
+    """Lista de trabajos; se refresca sola sin recargar toda la página."""
+    trabajos = fx_db.get_recent_jobs(limit=5, branch=sucursal)
+    if not trabajos:
+        return
+
+    st.markdown("#### ⏳ Trabajos recientes")
+    for job in trabajos:
+        col_j1, col_j2 = st.columns([3, 1])
+        with col_j1:
+            st.write(f"**{job['kind']}** · {job['created_at']} · {job['status']}")
+            if job["status"] == jobs.ESTADO_EN_PROCESO:
+                st.progress(job["progress"] or 0.0, text=job["message"] or "")
+            elif job["status"] == jobs.ESTADO_ERROR:
+                st.caption(job["error"])
+        with col_j2:
+            if job["status"] == jobs.ESTADO_LISTO and os.path.exists(job["output_path"]):
+                info = os.stat(job["output_path"])
+                st.download_button(
+                    label="📥 Descargar",
+                    data=leer_archivo(job["output_path"], info.st_mtime, info.st_size),
+                    file_name=job["file_name"],
+                    mime=MIME_TRABAJOS.get(job["kind"], "application/octet-stream"),
+                    key=f"descargar_job_{job['id']}",
+                )
 
-        output.seek(0)
 
-        st.download_button(
-            label="📥 Descargar Excel",
-            data=output,
-            file_name="agenda_excel.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        )
+panel_trabajos()
 
 # --- IMPORTAR BD ---
 with col_imp:
@@ -944,7 +1360,48 @@ with col_imp:
     )
 
     if archivo_subido:
-        with open(DB_NAME, "wb") as f:
-            f.write(archivo_subido.read())
-        st.success("✅ Base de datos importada correctamente. Recargando...")
-        st.rerun()
+        try:
+            fx_db.replace_db(archivo_subido.read(), branch=sucursal)
+        except ValueError as e:
+            st.error(str(e))
+        else:
+            st.success("✅ Base de datos importada correctamente. Recargando...")
+            st.rerun()
+
+# =========================
+# MANTENIMIENTO DE LA BD
+# =========================
+with st.expander("🛠️ Mantenimiento de la base de datos", expanded=False):
+    calcular_frag = st.checkbox(
+        "Calcular fragmentación (lee todo el archivo)",
+        key="calcular_fragmentacion",
+    )
+    stats_db = fx_db.db_stats(fragmentation=calcular_frag, branch=sucursal)
+
+    col_m1, col_m2, col_m3, col_m4 = st.columns(4)
+    col_m1.metric("Tamaño", f"{stats_db['file_size'] / 1024 / 1024:.1f} MB")
+    col_m2.metric("WAL", f"{stats_db['wal_size'] / 1024 / 1024:.1f} MB")
+    col_m3.metric(
+        "Páginas libres",
+        f"{stats_db['free_pages']:,}",
+        f"{stats_db['free_ratio']:.0%} del archivo",
+        delta_color="off",
+    )
+    col_m4.metric(
+        "Fragmentación",
+        "—" if stats_db["fragmentation"] is None else f"{stats_db['fragmentation']:.0%}",
+    )
+
+    st.caption(
+        f"Modo: {stats_db['journal_mode']} · "
+        f"Vacuum incremental: {'sí' if stats_db['auto_vacuum'] else 'pendiente (usa el botón de abajo)'} · "
+        f"Último mantenimiento: {stats_db['last_run'] or 'nunca'}"
+        + (f" ({stats_db['last_detail']})" if stats_db["last_detail"] else "")
+    )
+
+    if st.button("🛠️ Ejecutar mantenimiento ahora"):
+        # Desde aquí sí se hace la conversión a vacuum incremental (VACUUM)
+        get_executor().submit(
+            fx_db.run_maintenance, force=True, convert=True, branch=sucursal
+        )
+        st.toast("Mantenimiento en proceso…")
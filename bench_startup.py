@@ -0,0 +1,114 @@
+"""
+Benchmark de arranque en frío.
+
+Mide dos cosas y falla (exit 1) si alguna se pasa del presupuesto:
+
+1. `python -X importtime` de los módulos que carga app.py al arrancar:
+   ninguno de los paquetes pesados (pandas, openpyxl, pyarrow, numpy) debe
+   aparecer, y el tiempo acumulado debe quedar bajo --import-budget-ms.
+2. Tiempo hasta el primer render de app.py con el AppTest de Streamlit,
+   sobre una BD vacía en una carpeta temporal (--render-budget-ms).
+
+Uso:
+    python bench_startup.py
+    python bench_startup.py --import-budget-ms 300 --render-budget-ms 3000
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Lo que importa app.py a nivel módulo (además de streamlit); fx_db carga
+# sus submódulos (dedup, jobs, maintenance, recurrence, routes)
+STARTUP_MODULES = ["fx_db"]
+
+# Paquetes que solo deben cargarse al exportar o generar reportes
+HEAVY_MODULES = ["pandas", "openpyxl", "pyarrow", "numpy"]
+
+
+def measure_imports():
+    """Regresa (microsegundos acumulados, paquetes pesados cargados)."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + ", ".join(STARTUP_MODULES)],
+        cwd=APP_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    total_us = 0
+    pesados = set()
+    for linea in result.stderr.splitlines():
+        # "import time:   self [us] | cumulative | imported package"
+        if not linea.startswith("import time:") or "cumulative" in linea:
+            continue
+        _, cumulative, columna = linea[len("import time:"):].split("|")
+        nombre = columna.strip()
+        # Solo los de primer nivel (una sangría): el acumulado de fx_db ya
+        # incluye sus submódulos; sumar todos lo contaría doble
+        nivel = (len(columna) - len(columna.lstrip()) - 1) // 2
+        if nivel == 0 and nombre in STARTUP_MODULES:
+            total_us += int(cumulative)
+        if nombre.split(".")[0] in HEAVY_MODULES:
+            pesados.add(nombre.split(".")[0])
+    return total_us, sorted(pesados)
+
+
+def measure_first_render():
+    """Milisegundos hasta el primer render (None si no hay streamlit)."""
+    try:
+        from streamlit.testing.v1 import AppTest
+    except ImportError:
+        return None
+
+    with tempfile.TemporaryDirectory() as tmp:
+        anterior = os.getcwd()
+        os.chdir(tmp)
+        try:
+            inicio = time.perf_counter()
+            at = AppTest.from_file(os.path.join(APP_DIR, "app.py"), default_timeout=60)
+            at.run()
+            ms = (time.perf_counter() - inicio) * 1000
+        finally:
+            os.chdir(anterior)
+
+    if at.exception:
+        raise RuntimeError(f"app.py falló en el primer render: {at.exception[0].value}")
+    return ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--import-budget-ms", type=float, default=250)
+    parser.add_argument("--render-budget-ms", type=float, default=4000)
+    args = parser.parse_args()
+
+    ok = True
+
+    total_us, pesados = measure_imports()
+    print(f"Imports de arranque: {total_us / 1000:.1f} ms")
+    if pesados:
+        print(f"  ❌ se cargan paquetes pesados al arrancar: {', '.join(pesados)}")
+        ok = False
+    if total_us / 1000 > args.import_budget_ms:
+        print(f"  ❌ se pasa del presupuesto de {args.import_budget_ms:.0f} ms")
+        ok = False
+
+    render_ms = measure_first_render()
+    if render_ms is None:
+        print("Primer render: streamlit no está instalado, se omite")
+    else:
+        print(f"Primer render: {render_ms:.0f} ms")
+        if render_ms > args.render_budget_ms:
+            print(f"  ❌ se pasa del presupuesto de {args.render_budget_ms:.0f} ms")
+            ok = False
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
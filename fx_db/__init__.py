@@ -0,0 +1,1480 @@
+import functools
+import heapq
+import itertools
+import os
+import re
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, fields
+from datetime import date, datetime, time
+
+from . import dedup, jobs, maintenance, recurrence, routes
+
+DB_NAME = "agenda.db"
+
+
+# =========================
+# REGISTROS
+# =========================
+# Clientes y servicios se regresan como dataclasses con __slots__ en vez de
+# sqlite3.Row: ocupan menos memoria por fila, se leen con atributos
+# (r.client_name) y la fecha/hora ya vienen convertidas a date/time.
+
+def _parse_date(valor):
+    if not valor:
+        return None
+    try:
+        return date.fromisoformat(valor)
+    except ValueError:
+        return None
+
+
+def _parse_time(valor):
+    if not valor:
+        return None
+    try:
+        return time.fromisoformat(valor)
+    except ValueError:
+        return None
+
+
+@dataclass(slots=True)
+class Client:
+    id: int = None
+    name: str = None
+    business_name: str = None
+    address: str = None
+    zone: str = None
+    phone: str = None
+    notes: str = None
+    is_monthly: bool = False
+    monthly_day: int = None
+    display_label: str = None
+
+
+@dataclass(slots=True)
+class Appointment:
+    id: int = None
+    client_name: str = None
+    service_type: str = None
+    pest_type: str = None
+    address: str = None
+    zone: str = None
+    phone: str = None
+    date: date = None
+    time: time = None
+    price: float = None
+    status: str = None
+    notes: str = None
+    created_at: str = None
+    is_monthly_service: bool = False
+    crew: str = None
+    client_id: int = None
+    branch: str = None
+
+    @property
+    def time_str(self):
+        """Hora como "HH:MM" (o "" si no hay)."""
+        return self.time.strftime("%H:%M") if self.time else ""
+
+
+# Conversión por columna; lo que no aparece aquí se pasa tal cual
+_CONVERSIONES = {
+    Client: {"is_monthly": bool},
+    Appointment: {
+        "date": _parse_date,
+        "time": _parse_time,
+        "is_monthly_service": bool,
+    },
+}
+
+
+def _record_factory(cls):
+    """
+    row_factory para un cursor que arma registros `cls`.
+
+    La correspondencia columna → campo se calcula con la primera fila y se
+    reutiliza en las demás, así cada fila cuesta solo armar el objeto.
+    Las columnas que el registro no conoce se ignoran.
+    """
+    campos = {f.name for f in fields(cls)}
+    conversiones = _CONVERSIONES[cls]
+    plan = None
+
+    def factory(cursor, row):
+        nonlocal plan
+        if plan is None:
+            plan = [
+                (i, col[0], conversiones.get(col[0]))
+                for i, col in enumerate(cursor.description)
+                if col[0] in campos
+            ]
+        valores = {}
+        for i, nombre, convertir in plan:
+            valor = row[i]
+            valores[nombre] = convertir(valor) if convertir and valor is not None else valor
+        return cls(**valores)
+
+    return factory
+
+
+def client_factory():
+    """row_factory nuevo para un cursor de clientes."""
+    return _record_factory(Client)
+
+
+def appointment_factory():
+    """row_factory nuevo para un cursor de servicios."""
+    return _record_factory(Appointment)
+
+# =========================
+# SUCURSALES
+# =========================
+# Cada sucursal tiene su propio archivo .db. La principal sigue siendo
+# agenda.db (así las instalaciones existentes no cambian); las demás viven
+# en la carpeta sucursales/. Las escrituras van siempre a UNA sucursal y la
+# lectura consolidada junta todas.
+MAIN_BRANCH = "Principal"
+BRANCHES_DIR = "sucursales"
+
+# Límite de ATTACH por conexión en SQLite (SQLITE_MAX_ATTACHED por defecto).
+# Con más sucursales que esto se consulta cada archivo en un hilo aparte.
+MAX_ATTACHED = 10
+
+# Columnas que se leen en la vista consolidada. Se listan explícitas para
+# que el UNION ALL no dependa del orden de columnas de cada archivo.
+APPOINTMENT_COLUMNS = [
+    "id", "client_name", "service_type", "pest_type", "address", "zone",
+    "phone", "date", "time", "price", "status", "notes", "created_at",
+    "is_monthly_service", "crew", "client_id",
+]
+
+
+def _slug(texto):
+    return re.sub(r"[^a-z0-9]+", "_", texto.strip().lower()).strip("_")
+
+
+def branch_db_path(branch=None):
+    """Archivo .db de una sucursal (None o la principal → agenda.db)."""
+    if not branch or branch == MAIN_BRANCH:
+        return DB_NAME
+    return os.path.join(BRANCHES_DIR, f"{_slug(branch)}.db")
+
+
+def list_branches():
+    """Sucursal principal + una por cada archivo en sucursales/."""
+    branches = [MAIN_BRANCH]
+    if os.path.isdir(BRANCHES_DIR):
+        for nombre in sorted(os.listdir(BRANCHES_DIR)):
+            if nombre.endswith(".db"):
+                branches.append(nombre[:-3])
+    return branches
+
+
+def create_branch(branch):
+    """Crea el archivo de una sucursal nueva con sus tablas."""
+    os.makedirs(BRANCHES_DIR, exist_ok=True)
+    init_db(branch)
+    return _slug(branch)
+
+
+def get_conn(branch=None):
+    conn = sqlite3.connect(branch_db_path(branch), timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+# Conexiones de lectura que se reutilizan dentro de cada hilo. Así el caché
+# de sentencias preparadas de sqlite3 (cached_statements) sí sirve entre
+# consultas, en vez de perderse al cerrar la conexión cada vez.
+_read_local = threading.local()
+
+
+def read_conn(branch=None):
+    """
+    Conexión de solo lectura reutilizable para este hilo.
+
+    Si el archivo .db se reemplazó (importar BD) se abre una nueva, para no
+    seguir leyendo el archivo viejo. No se debe cerrar.
+    """
+    path = branch_db_path(branch)
+    inodo = os.stat(path).st_ino if os.path.exists(path) else None
+
+    conexiones = getattr(_read_local, "conexiones", None)
+    if conexiones is None:
+        conexiones = _read_local.conexiones = {}
+
+    guardada = conexiones.get(path)
+    if guardada is None or guardada[0] != inodo:
+        if guardada is not None:
+            guardada[1].close()
+        conn = sqlite3.connect(path, timeout=30, cached_statements=256)
+        conn.row_factory = sqlite3.Row
+        guardada = conexiones[path] = (inodo, conn)
+    return guardada[1]
+
+
+# ---------- LECTURA POR LOTES ----------
+# Para exportaciones y procesos que recorren tablas completas: en vez de
+# fetchall() se lee con fetchmany, así en memoria solo hay un lote a la vez
+# sin importar cuántas filas tenga la tabla.
+
+ITER_BATCH_SIZE = 1000
+
+
+def _iter_rows(query, params, row_factory, batch_size, batches, branch, conn):
+    """
+    Generador sobre el resultado de `query`, lote por lote.
+
+    Con batches=True regresa listas de hasta `batch_size` registros; si no,
+    registro por registro. Si se da `conn` se usa esa (y no se cierra); si
+    no, se abre una propia. El cursor (y la conexión propia) se cierran al
+    terminar, al fallar o cuando el generador se abandona a la mitad.
+    """
+    propia = conn is None
+    if propia:
+        conn = get_conn(branch)
+    c = conn.cursor()
+    try:
+        c.row_factory = row_factory()
+        c.execute(query, params)
+        while True:
+            lote = c.fetchmany(batch_size)
+            if not lote:
+                break
+            if batches:
+                yield lote
+            else:
+                yield from lote
+    finally:
+        c.close()
+        if propia:
+            conn.close()
+
+
+# Archivos (ruta, inodo) ya migrados en este proceso
+_migrated = set()
+_migrated_lock = threading.Lock()
+
+
+def _file_key(branch):
+    path = branch_db_path(branch)
+    return path, os.stat(path).st_ino if os.path.exists(path) else None
+
+
+def ensure_migrated(branches=None):
+    """
+    Corre init_db una vez por proceso en cada sucursal que no se haya
+    abierto todavía. Las consultas consolidadas lo necesitan: una sucursal
+    que nadie eligió desde un cambio de esquema no tiene las columnas nuevas.
+    """
+    for branch in branches or list_branches():
+        if _file_key(branch) not in _migrated:
+            init_db(branch)
+
+
+def init_db(branch=None):
+    conn = get_conn(branch)
+    c = conn.cursor()
+
+    # Solo tiene efecto en una BD vacía: así nace lista para el vacuum
+    # incremental y no necesita el VACUUM de conversión (fx_db.maintenance)
+    c.execute("PRAGMA auto_vacuum = INCREMENTAL;")
+
+    # Tabla de clientes
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS clients (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            business_name TEXT,
+            address TEXT,
+            zone TEXT,
+            phone TEXT,
+            notes TEXT,
+            is_monthly INTEGER DEFAULT 0,
+            monthly_day INTEGER
+        );
+    """)
+
+    # Tabla de servicios (citas)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS appointments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            client_name TEXT NOT NULL,
+            service_type TEXT,
+            pest_type TEXT,
+            address TEXT,
+            zone TEXT,
+            phone TEXT,
+            date TEXT NOT NULL,
+            time TEXT NOT NULL,
+            price REAL,
+            status TEXT,
+            notes TEXT,
+            created_at TEXT
+        );
+    """)
+
+    # Asegurar columna para marcar servicio mensual
+    try:
+        c.execute("ALTER TABLE appointments ADD COLUMN is_monthly_service INTEGER DEFAULT 0;")
+    except Exception:
+        # Si ya existe, ignoramos el error
+        pass
+
+    # Cuadrilla asignada al servicio (para armar la ruta del día)
+    try:
+        c.execute("ALTER TABLE appointments ADD COLUMN crew TEXT;")
+    except Exception:
+        # Si ya existe, ignoramos el error
+        pass
+
+    # Etiqueta para mostrar en los selectores: "Negocio (Contacto)".
+    # Es una columna generada, así SQLite la calcula y la podemos indexar.
+    try:
+        c.execute("""
+            ALTER TABLE clients ADD COLUMN display_label TEXT
+            GENERATED ALWAYS AS (
+                CASE
+                    WHEN COALESCE(business_name, '') <> '' AND COALESCE(name, '') <> ''
+                        THEN business_name || ' (' || name || ')'
+                    ELSE COALESCE(NULLIF(business_name, ''), name)
+                END
+            ) VIRTUAL;
+        """)
+    except Exception:
+        # Si ya existe, ignoramos el error
+        pass
+
+    # Llaves normalizadas (nombre, "cómo suena", teléfono) para duplicados
+    dedup.init_dedup(conn)
+
+    # Índices para ordenar clientes sin hacer sort en cada consulta
+    c.execute("CREATE INDEX IF NOT EXISTS idx_clients_label ON clients (display_label, id);")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_clients_orden ON clients (business_name, name);")
+
+    # client_id + índices de los filtros de AppointmentQuery
+    migrate_appointments(conn)
+
+    # Índice del resumen del calendario:
+    # (date, status, price) cubre el GROUP BY date sin tocar la tabla
+    c.execute(
+        "CREATE INDEX IF NOT EXISTS idx_appointments_calendario "
+        "ON appointments (date, status, price);"
+    )
+
+    # Tabla de trabajos en segundo plano (exportaciones, respaldos)
+    jobs.init_jobs_table(conn)
+
+    # Coordenadas por colonia/zona para las rutas; se llena desde el CSV
+    # la primera vez (después se recarga con el botón de la sección Rutas)
+    routes.init_zone_table(conn)
+    if c.execute("SELECT COUNT(*) FROM zone_coords").fetchone()[0] == 0:
+        routes.seed_zone_coords(conn)
+
+    conn.commit()
+
+    # Modo WAL + tabla del mantenimiento automático (fuera de transacción)
+    maintenance.init_maintenance(conn)
+    conn.close()
+    with _migrated_lock:
+        _migrated.add(_file_key(branch))
+
+
+def migrate_appointments(conn):
+    """
+    Columnas e índices de servicios que usa AppointmentQuery.
+
+    La primera vez también liga los servicios viejos con su cliente (client_id) por nombre.
+    """
+    c = conn.cursor()
+
+    try:
+        c.execute("ALTER TABLE appointments ADD COLUMN client_id INTEGER;")
+    except Exception:
+        # Si ya existe, ignoramos el error
+        pass
+
+    c.execute("CREATE INDEX IF NOT EXISTS idx_appointments_fecha ON appointments (date, time);")
+    c.execute(
+        "CREATE INDEX IF NOT EXISTS idx_appointments_nombre "
+        "ON appointments (client_name, date, time);"
+    )
+    c.execute("CREATE INDEX IF NOT EXISTS idx_appointments_zona ON appointments (zone, date);")
+    c.execute(
+        "CREATE INDEX IF NOT EXISTS idx_appointments_estado "
+        "ON appointments (status, date);"
+    )
+    c.execute(
+        "CREATE INDEX IF NOT EXISTS idx_appointments_mensual "
+        "ON appointments (is_monthly_service, date) WHERE is_monthly_service = 1;"
+    )
+
+    # Serie y periodo de los servicios mensuales generados (fx_db.recurrence)
+    recurrence.init_recurrence(conn)
+
+    # Meses (YYYY-MM) con servicios nuevos, editados o borrados desde la
+    # última exportación incremental (ver export.export_parquet)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS changed_months (
+            month TEXT PRIMARY KEY
+        ) WITHOUT ROWID;
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_appointments_mes_insert
+        AFTER INSERT ON appointments
+        BEGIN
+            INSERT OR IGNORE INTO changed_months (month) VALUES (substr(NEW.date, 1, 7));
+        END;
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_appointments_mes_update
+        AFTER UPDATE ON appointments
+        BEGIN
+            INSERT OR IGNORE INTO changed_months (month) VALUES (substr(OLD.date, 1, 7));
+            INSERT OR IGNORE INTO changed_months (month) VALUES (substr(NEW.date, 1, 7));
+        END;
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_appointments_mes_delete
+        AFTER DELETE ON appointments
+        BEGIN
+            INSERT OR IGNORE INTO changed_months (month) VALUES (substr(OLD.date, 1, 7));
+        END;
+    """)
+
+    # Migración única (PRAGMA user_version 0 → 1): ligar client_id por nombre
+    if c.execute("PRAGMA user_version").fetchone()[0] < 1:
+        c.execute("""
+            UPDATE appointments
+            SET client_id = (
+                SELECT cl.id FROM clients cl
+                WHERE COALESCE(NULLIF(cl.business_name, ''), cl.name)
+                      = appointments.client_name
+                ORDER BY cl.id
+                LIMIT 1
+            )
+            WHERE client_id IS NULL
+        """)
+        c.execute("PRAGMA user_version = 1")
+
+    _init_client_stats(c)
+    _init_data_version(c)
+
+
+# Estados que cuentan como visita hecha; "Realizado" todavía no se cobra
+_VISITA_HECHA = "('Realizado', 'Cobrado')"
+
+
+def _init_client_stats(c):
+    """
+    Tabla client_stats: totales por cliente que mantienen los triggers.
+
+    Cada alta, cambio o baja de un servicio suma o resta su parte en el
+    renglón de su cliente, así el historial no tiene que recorrer todos sus
+    servicios para los totales.
+    """
+    # Cubre el historial (y la última/próxima visita) sin leer la tabla;
+    # reemplaza al índice (client_id, date, time) de versiones anteriores
+    c.execute("DROP INDEX IF EXISTS idx_appointments_cliente;")
+    c.execute(
+        "CREATE INDEX IF NOT EXISTS idx_appointments_cliente_hist "
+        "ON appointments (client_id, date, time, status, price);"
+    )
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS client_stats (
+            client_id INTEGER PRIMARY KEY,
+            services INTEGER NOT NULL DEFAULT 0,
+            visits INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0,
+            outstanding REAL NOT NULL DEFAULT 0
+        );
+    """)
+
+    # Lo que aporta un servicio (NEW o OLD) a los totales de su cliente
+    def aporte(fila, signo):
+        return (
+            f"{signo}1, "
+            f"{signo}({fila}.status IN {_VISITA_HECHA}), "
+            f"{signo}(CASE WHEN {fila}.status = 'Cobrado' THEN COALESCE({fila}.price, 0) ELSE 0 END), "
+            f"{signo}(CASE WHEN {fila}.status = 'Realizado' THEN COALESCE({fila}.price, 0) ELSE 0 END)"
+        )
+
+    def sumar(fila, signo):
+        return f"""
+            INSERT INTO client_stats (client_id, services, visits, revenue, outstanding)
+            VALUES ({fila}.client_id, {aporte(fila, signo)})
+            ON CONFLICT (client_id) DO UPDATE SET
+                services = services + excluded.services,
+                visits = visits + excluded.visits,
+                revenue = revenue + excluded.revenue,
+                outstanding = outstanding + excluded.outstanding;
+        """
+
+    c.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_client_stats_insert
+        AFTER INSERT ON appointments
+        WHEN NEW.client_id IS NOT NULL
+        BEGIN
+            {sumar("NEW", "")}
+        END;
+    """)
+    c.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_client_stats_delete
+        AFTER DELETE ON appointments
+        WHEN OLD.client_id IS NOT NULL
+        BEGIN
+            {sumar("OLD", "-")}
+        END;
+    """)
+    # Un cambio es restar lo viejo y sumar lo nuevo (sirve también cuando
+    # el servicio pasa a otro cliente, por ejemplo al unir duplicados)
+    c.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_client_stats_update_old
+        AFTER UPDATE OF client_id, status, price ON appointments
+        WHEN OLD.client_id IS NOT NULL
+        BEGIN
+            {sumar("OLD", "-")}
+        END;
+    """)
+    c.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_client_stats_update_new
+        AFTER UPDATE OF client_id, status, price ON appointments
+        WHEN NEW.client_id IS NOT NULL
+        BEGIN
+            {sumar("NEW", "")}
+        END;
+    """)
+    # Al borrar un cliente sus servicios quedan sin cliente; si conservaran
+    # el client_id, cualquier cambio posterior revivía un renglón inválido
+    version = c.execute("PRAGMA user_version").fetchone()[0]
+    if version < 3:
+        # Versión anterior del trigger (solo borraba el renglón)
+        c.execute("DROP TRIGGER IF EXISTS trg_client_stats_cliente_borrado;")
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_client_stats_cliente_borrado
+        AFTER DELETE ON clients
+        BEGIN
+            UPDATE appointments SET client_id = NULL WHERE client_id = OLD.id;
+            DELETE FROM client_stats WHERE client_id = OLD.id;
+        END;
+    """)
+
+    # Migración única (user_version 1 → 3): soltar los servicios de clientes
+    # ya borrados y llenar client_stats con lo que ya existe
+    if version < 3:
+        c.execute("""
+            UPDATE appointments SET client_id = NULL
+            WHERE client_id IS NOT NULL
+              AND client_id NOT IN (SELECT id FROM clients)
+        """)
+        rebuild_client_stats(c)
+        c.execute("PRAGMA user_version = 3")
+
+
+def _init_data_version(c):
+    """
+    Contador de escrituras de clientes y servicios (tabla data_version).
+
+    Cada alta, cambio o baja lo sube en uno desde un trigger, así dos
+    lecturas con el mismo número ven exactamente los mismos datos. A
+    diferencia de PRAGMA data_version, se guarda en el archivo y no depende
+    de la conexión. `instance` cambia al importar otra BD (ver
+    maintenance.replace_db) para que sus números no se confundan.
+    """
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS data_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL,
+            instance TEXT NOT NULL
+        );
+    """)
+    c.execute(
+        "INSERT OR IGNORE INTO data_version (id, version, instance) "
+        "VALUES (1, 0, lower(hex(randomblob(8))))"
+    )
+    for tabla in ("clients", "appointments"):
+        for evento in ("INSERT", "UPDATE", "DELETE"):
+            c.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_version_{tabla}_{evento.lower()}
+                AFTER {evento} ON {tabla}
+                BEGIN
+                    UPDATE data_version SET version = version + 1 WHERE id = 1;
+                END;
+            """)
+
+
+def get_data_version(branch=None, conn=None):
+    """"<instance>:<version>" de los datos de la sucursal."""
+    conn = conn or read_conn(branch)
+    instance, version = conn.execute(
+        "SELECT instance, version FROM data_version WHERE id = 1"
+    ).fetchone()
+    return f"{instance}:{version}"
+
+
+def rebuild_client_stats(c):
+    """Recalcula client_stats desde cero (un GROUP BY sobre el índice)."""
+    c.execute("DELETE FROM client_stats")
+    c.execute(f"""
+        INSERT INTO client_stats (client_id, services, visits, revenue, outstanding)
+        SELECT client_id,
+               COUNT(*),
+               SUM(status IN {_VISITA_HECHA}),
+               SUM(CASE WHEN status = 'Cobrado' THEN COALESCE(price, 0) ELSE 0 END),
+               SUM(CASE WHEN status = 'Realizado' THEN COALESCE(price, 0) ELSE 0 END)
+        FROM appointments
+        WHERE client_id IS NOT NULL
+        GROUP BY client_id
+    """)
+
+
+# ---------- CLIENTES ----------
+
+def add_client(name, business_name, address, zone, phone, notes,
+               is_monthly=False, monthly_day=None, branch=None):
+    conn = get_conn(branch)
+    c = conn.cursor()
+    c.execute("""
+        INSERT INTO clients (
+            name, business_name, address, zone, phone, notes,
+            is_monthly, monthly_day,
+            name_key, sound_key, phone_key
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (
+        name,
+        business_name,
+        address,
+        zone,
+        phone,
+        notes,
+        1 if is_monthly else 0,
+        monthly_day,
+        *dedup.client_keys(name, business_name, phone),
+    ))
+    client_id = c.lastrowid
+    conn.commit()
+    conn.close()
+    return client_id
+
+
+def update_client(client_id, name, business_name, address, zone, phone, notes,
+                  is_monthly=False, monthly_day=None, branch=None):
+    """Actualiza los datos de un cliente existente."""
+    conn = get_conn(branch)
+    c = conn.cursor()
+    c.execute("""
+        UPDATE clients
+        SET name = ?, business_name = ?, address = ?, zone = ?, phone = ?, notes = ?,
+            is_monthly = ?, monthly_day = ?,
+            name_key = ?, sound_key = ?, phone_key = ?
+        WHERE id = ?
+    """, (
+        name,
+        business_name,
+        address,
+        zone,
+        phone,
+        notes,
+        1 if is_monthly else 0,
+        monthly_day if is_monthly else None,
+        *dedup.client_keys(name, business_name, phone),
+        client_id,
+    ))
+    conn.commit()
+    conn.close()
+
+
+def delete_client(client_id, branch=None):
+    """Elimina un cliente de la tabla clients."""
+    conn = get_conn(branch)
+    c = conn.cursor()
+    c.execute("DELETE FROM clients WHERE id = ?", (client_id,))
+    conn.commit()
+    conn.close()
+
+
+def get_client(client_id, branch=None):
+    """Regresa un cliente por su ID (o None si no existe)."""
+    c = read_conn(branch).cursor()
+    c.row_factory = client_factory()
+    c.execute("SELECT * FROM clients WHERE id = ?", (client_id,))
+    row = c.fetchone()
+    c.close()
+    return row
+
+
+def get_client_labels(branch=None):
+    """
+    Regresa (etiquetas, etiqueta -> id) para los selectores de clientes.
+
+    Se lee directo del índice de display_label. Si dos clientes tienen la
+    misma etiqueta se les agrega el ID ("Juan #12") para que no se pisen.
+    """
+    c = read_conn(branch).cursor()
+    c.execute("""
+        SELECT id, display_label,
+               COUNT(*) OVER (PARTITION BY display_label) AS repetidos
+        FROM clients
+        ORDER BY display_label, id;
+    """)
+    etiquetas = []
+    etiqueta_a_id = {}
+    for client_id, etiqueta, repetidos in c.fetchall():
+        etiqueta = etiqueta or "Cliente sin nombre"
+        if repetidos > 1:
+            etiqueta = f"{etiqueta} #{client_id}"
+        etiquetas.append(etiqueta)
+        etiqueta_a_id[etiqueta] = client_id
+    c.close()
+    return etiquetas, etiqueta_a_id
+
+
+def get_clients(branch=None):
+    return list(iter_clients(order_by=("business_name", "name"), branch=branch))
+
+
+def iter_clients(order_by=("id",), batch_size=ITER_BATCH_SIZE, batches=False,
+                 branch=None, conn=None):
+    """
+    Recorre los clientes sin cargarlos todos (ver _iter_rows).
+
+        for lote in iter_clients(batches=True):
+            ...
+    """
+    campos = {f.name for f in fields(Client)}
+    for col in order_by:
+        if col not in campos:
+            raise ValueError(f"No se puede ordenar por {col!r}")
+    query = f"SELECT * FROM clients ORDER BY {', '.join(order_by)}"
+    return _iter_rows(query, (), client_factory, batch_size, batches, branch, conn)
+
+
+@dataclass(slots=True)
+class ClientStats:
+    client_id: int
+    services: int = 0
+    visits: int = 0
+    revenue: float = 0.0
+    outstanding: float = 0.0
+    last_visit: date = None
+    next_visit: date = None
+    next_visit_time: time = None
+
+
+def get_client_stats(client_id, hoy=None, branch=None):
+    """
+    Totales del historial de un cliente.
+
+    Los conteos y montos salen de client_stats (una fila); la última y la
+    próxima visita son una búsqueda en el índice (client_id, date, ...).
+    """
+    hoy = str(hoy or date.today())
+    c = read_conn(branch).cursor()
+    fila = c.execute(
+        "SELECT services, visits, revenue, outstanding FROM client_stats WHERE client_id = ?",
+        (client_id,),
+    ).fetchone()
+    stats = ClientStats(client_id, *fila) if fila else ClientStats(client_id)
+
+    # Última visita HECHA (igual que "visits"); el índice cubre el status
+    fila = c.execute(
+        "SELECT MAX(date) FROM appointments "
+        f"WHERE client_id = ? AND date < ? AND status IN {_VISITA_HECHA}",
+        (client_id, hoy),
+    ).fetchone()
+    stats.last_visit = _parse_date(fila[0])
+
+    fila = c.execute(
+        "SELECT date, time FROM appointments WHERE client_id = ? AND date >= ? "
+        "ORDER BY date, time LIMIT 1",
+        (client_id, hoy),
+    ).fetchone()
+    if fila:
+        stats.next_visit, stats.next_visit_time = _parse_date(fila[0]), _parse_time(fila[1])
+    c.close()
+    return stats
+
+
+def get_client_history(client_id, page=0, page_size=20, branch=None):
+    """Una página de los servicios del cliente, del más reciente al más viejo."""
+    return (
+        AppointmentQuery(branch)
+        .client(client_id=client_id)
+        .order_by("-date", "-time")
+        .limit(page_size, page * page_size)
+        .fetch()
+    )
+
+
+# ---------- SERVICIOS ----------
+
+def add_appointment(client_name, service_type, pest_type,
+                    address, zone, phone, date, time,
+                    price, status, notes, is_monthly_service=False, crew=None,
+                    client_id=None, branch=None):
+    conn = get_conn(branch)
+    c = conn.cursor()
+    created_at = datetime.now().isoformat(timespec="seconds")
+
+    c.execute("""
+        INSERT INTO appointments (
+            client_name, service_type, pest_type,
+            address, zone, phone,
+            date, time, price,
+            status, notes, created_at, is_monthly_service, crew, client_id
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (
+        client_name,
+        service_type,
+        pest_type,
+        address,
+        zone,
+        phone,
+        date,
+        time,
+        price,
+        status,
+        notes,
+        created_at,
+        1 if is_monthly_service else 0,
+        crew or None,
+        client_id,
+    ))
+    appointment_id = c.lastrowid
+    conn.commit()
+    conn.close()
+    return appointment_id
+
+
+def get_appointments(date_from=None, date_to=None, status=None, branch=None):
+    return (
+        AppointmentQuery(branch)
+        .date_range(date_from, date_to)
+        .status(status)
+        .fetch()
+    )
+
+
+def get_appointment(appointment_id, branch=None):
+    """Un servicio por su ID (o None)."""
+    return AppointmentQuery(branch).id(appointment_id).first()
+
+
+def iter_appointments(query=None, batch_size=ITER_BATCH_SIZE, batches=False,
+                      branch=None, conn=None):
+    """
+    Recorre servicios sin cargarlos todos (ver _iter_rows).
+
+    `query` es un AppointmentQuery con filtros; sin él son todos los
+    servicios de la sucursal por fecha y hora.
+    """
+    query = query or AppointmentQuery(branch)
+    return query.iter(batch_size, batches, conn)
+
+
+# Columnas que se pueden escribir celda por celda desde la tabla editable
+EDITABLE_COLUMNS = {
+    "client_name", "pest_type", "zone", "address", "phone",
+    "price", "status", "crew", "notes",
+}
+
+
+def _same_value(a, b):
+    # pandas convierte los None en NaN; NaN != NaN, así que los igualamos aquí
+    vacio_a = a is None or a != a or a == ""
+    vacio_b = b is None or b != b or b == ""
+    if vacio_a or vacio_b:
+        return vacio_a and vacio_b
+    return a == b
+
+
+def diff_appointment_rows(originales, editadas, columnas):
+    """
+    Compara la tabla antes/después de editar (listas de dicts con "ID").
+
+    `columnas` mapea el nombre en la tabla a la columna de la BD. Regresa
+    {columna_bd: [(valor_nuevo, id), ...]} solo con las celdas que cambiaron.
+    """
+    por_id = {fila["ID"]: fila for fila in originales}
+    cambios = {}
+    for fila in editadas:
+        original = por_id.get(fila["ID"])
+        if original is None:
+            continue
+        for etiqueta, columna in columnas.items():
+            nuevo = fila.get(etiqueta)
+            if not _same_value(original.get(etiqueta), nuevo):
+                if nuevo != nuevo:
+                    nuevo = None
+                # int(): pandas regresa numpy.int64, que sqlite3 no acepta
+                cambios.setdefault(columna, []).append((nuevo, int(fila["ID"])))
+    return cambios
+
+
+def update_appointments_cells(cambios, branch=None):
+    """
+    Escribe {columna: [(valor, id), ...]} con un executemany por columna,
+    todo en una sola transacción (si algo falla no se guarda nada).
+    Regresa cuántas celdas se escribieron (los IDs que no existen no
+    cuentan).
+    """
+    for columna in cambios:
+        if columna not in EDITABLE_COLUMNS:
+            raise ValueError(f"La columna {columna!r} no se puede editar")
+
+    conn = get_conn(branch)
+    escritas = 0
+    with conn:
+        for columna, filas in cambios.items():
+            c = conn.executemany(
+                f"UPDATE appointments SET {columna} = ? WHERE id = ?",
+                filas,
+            )
+            escritas += c.rowcount
+    conn.close()
+    return escritas
+
+
+def bulk_update_status(appointment_ids, new_status, branch=None):
+    """Mismo estado para varios servicios en una sola transacción."""
+    return update_appointments_cells(
+        {"status": [(new_status, i) for i in appointment_ids]}, branch=branch
+    )
+
+
+# ---------- CONSULTAS DE SERVICIOS ----------
+
+class AppointmentQuery:
+    """
+    Arma consultas de servicios con filtros encadenables, todo en SQL.
+
+        AppointmentQuery().date_range("2025-01-01", "2025-01-31") \
+            .zone("Centro").status("Pendiente").order_by("-date").fetch()
+
+    Cada filtro agrega una condición con parámetros (nunca texto pegado).
+    Las condiciones salen siempre en el mismo orden sin importar el orden de
+    las llamadas, así la misma combinación de filtros produce el mismo SQL y
+    sqlite reutiliza la sentencia preparada de su caché (ver read_conn).
+    """
+
+    # Orden fijo de las condiciones; las primeras son las que tienen índice
+    _FILTROS = [
+        "id", "client_id", "client_name", "zone", "status", "monthly",
+        "date_from", "date_to", "crew", "service_type", "pest_type",
+        "price_min", "price_max", "text",
+    ]
+
+    _SQL = {
+        "id": "id = ?",
+        "client_id": "client_id = ?",
+        "client_name": "client_name = ?",
+        "zone": "zone = ?",
+        "status": "status = ?",
+        "monthly": "is_monthly_service = ?",
+        "date_from": "date >= ?",
+        "date_to": "date <= ?",
+        "crew": "COALESCE(crew, '') = ?",
+        "service_type": "service_type = ?",
+        "pest_type": "pest_type LIKE ?",
+        "price_min": "price >= ?",
+        "price_max": "price <= ?",
+        "text": (
+            "(client_name LIKE ? OR address LIKE ? OR zone LIKE ? "
+            "OR phone LIKE ? OR pest_type LIKE ? OR notes LIKE ?)"
+        ),
+    }
+
+    def __init__(self, branch=None):
+        self.branch = branch
+        self._valores = {}
+        self._orden = ["date", "time"]
+        self._limit = None
+        self._offset = 0
+
+    def _set(self, filtro, valor):
+        if valor is not None and valor != "":
+            self._valores[filtro] = valor
+        return self
+
+    def id(self, appointment_id):
+        return self._set("id", appointment_id)
+
+    def client(self, client_name=None, client_id=None):
+        self._set("client_name", client_name)
+        return self._set("client_id", client_id)
+
+    def zone(self, zone):
+        return self._set("zone", zone)
+
+    def status(self, status):
+        return self._set("status", None if status == "Todos" else status)
+
+    def monthly(self, flag=True):
+        return self._set("monthly", None if flag is None else (1 if flag else 0))
+
+    def date_range(self, date_from=None, date_to=None):
+        self._set("date_from", str(date_from) if date_from else None)
+        return self._set("date_to", str(date_to) if date_to else None)
+
+    def crew(self, crew):
+        # Aquí "" sí es un filtro: los servicios sin cuadrilla
+        if crew is not None:
+            self._valores["crew"] = crew
+        return self
+
+    def service_type(self, service_type):
+        return self._set("service_type", service_type)
+
+    def pest_type(self, pest_type):
+        return self._set("pest_type", f"%{pest_type}%" if pest_type else None)
+
+    def price_between(self, price_min=None, price_max=None):
+        self._set("price_min", price_min)
+        return self._set("price_max", price_max)
+
+    def text(self, texto):
+        return self._set("text", f"%{texto.strip()}%" if texto and texto.strip() else None)
+
+    def order_by(self, *columnas):
+        """Columnas de APPOINTMENT_COLUMNS; con "-" adelante va descendente."""
+        orden = []
+        for col in columnas:
+            if col.lstrip("-") not in APPOINTMENT_COLUMNS:
+                raise ValueError(f"No se puede ordenar por {col!r}")
+            orden.append(col[1:] + " DESC" if col.startswith("-") else col)
+        self._orden = orden
+        return self
+
+    def limit(self, limit, offset=0):
+        self._limit = limit
+        self._offset = offset
+        return self
+
+    def where(self):
+        """(" WHERE ...", params) con los filtros puestos."""
+        condiciones = []
+        params = []
+        for filtro in self._FILTROS:
+            if filtro not in self._valores:
+                continue
+            condiciones.append(self._SQL[filtro])
+            valor = self._valores[filtro]
+            params.extend([valor] * self._SQL[filtro].count("?"))
+        if not condiciones:
+            return "", params
+        return " WHERE " + " AND ".join(condiciones), params
+
+    def sql(self, columnas="*", table="appointments"):
+        """Regresa (query, params) listos para execute."""
+        where, params = self.where()
+        query = f"SELECT {columnas} FROM {table}{where}"
+        if self._orden:
+            query += " ORDER BY " + ", ".join(self._orden)
+        if self._limit is not None:
+            query += " LIMIT ? OFFSET ?"
+            params += [self._limit, self._offset]
+        return query, params
+
+    def fetch(self):
+        """Lista de registros Appointment."""
+        query, params = self.sql()
+        c = read_conn(self.branch).cursor()
+        c.row_factory = appointment_factory()
+        c.execute(query, params)
+        rows = c.fetchall()
+        c.close()
+        return rows
+
+    def iter(self, batch_size=ITER_BATCH_SIZE, batches=False, conn=None):
+        """Como fetch() pero como generador por lotes (ver _iter_rows)."""
+        query, params = self.sql()
+        return _iter_rows(
+            query, params, appointment_factory, batch_size, batches, self.branch, conn
+        )
+
+    def first(self):
+        self._limit, self._offset = 1, 0
+        rows = self.fetch()
+        return rows[0] if rows else None
+
+    def count(self):
+        where, params = self.where()
+        c = read_conn(self.branch).cursor()
+        c.execute(f"SELECT COUNT(*) FROM appointments{where}", params)
+        total = c.fetchone()[0]
+        c.close()
+        return total
+
+
+def update_status(appointment_id, new_status, branch=None):
+    conn = get_conn(branch)
+    c = conn.cursor()
+    c.execute(
+        "UPDATE appointments SET status = ? WHERE id = ?",
+        (new_status, appointment_id),
+    )
+    conn.commit()
+    conn.close()
+
+
+def delete_appointment(appointment_id, branch=None):
+    conn = get_conn(branch)
+    c = conn.cursor()
+    c.execute("DELETE FROM appointments WHERE id = ?", (appointment_id,))
+    conn.commit()
+    conn.close()
+
+
+def update_appointment_full(appointment_id, client_name, service_type, pest_type,
+                            address, zone, phone, date, time,
+                            price, status, notes, is_monthly_service, crew=None,
+                            branch=None):
+    """Actualiza todos los datos principales de un servicio."""
+    conn = get_conn(branch)
+    c = conn.cursor()
+    c.execute("""
+        UPDATE appointments
+        SET client_name = ?,
+            service_type = ?,
+            pest_type = ?,
+            address = ?,
+            zone = ?,
+            phone = ?,
+            date = ?,
+            time = ?,
+            price = ?,
+            status = ?,
+            notes = ?,
+            is_monthly_service = ?,
+            crew = ?
+        WHERE id = ?
+    """, (
+        client_name,
+        service_type,
+        pest_type,
+        address,
+        zone,
+        phone,
+        date,
+        time,
+        price,
+        status,
+        notes,
+        1 if is_monthly_service else 0,
+        crew or None,
+        appointment_id,
+    ))
+    conn.commit()
+    conn.close()
+
+
+# ---------- RESÚMENES ----------
+
+def get_calendar_summary(date_from, date_to, branch=None):
+    """
+    Resumen por día para el calendario: número de servicios, ingresos y
+    cuántos hay en cada estado. Es un solo GROUP BY date que se resuelve
+    con el índice idx_appointments_calendario, sin traer las filas.
+
+    Regresa un dict {"YYYY-MM-DD": fila}.
+    """
+    c = read_conn(branch).cursor()
+    c.execute("""
+        SELECT date,
+               COUNT(*) AS total,
+               COALESCE(SUM(price), 0) AS ingresos,
+               SUM(status = 'Pendiente') AS pendientes,
+               SUM(status = 'Confirmado') AS confirmados,
+               SUM(status = 'Realizado') AS realizados,
+               SUM(status = 'Cobrado') AS cobrados
+        FROM appointments
+        WHERE date BETWEEN ? AND ?
+        GROUP BY date
+        ORDER BY date
+    """, (date_from, date_to))
+    resumen = {r["date"]: r for r in c.fetchall()}
+    c.close()
+    return resumen
+
+
+def get_crews(fecha, branch=None):
+    """Cuadrillas con servicios en un día ('' = sin cuadrilla)."""
+    c = read_conn(branch).cursor()
+    c.execute("""
+        SELECT DISTINCT COALESCE(crew, '') AS crew
+        FROM appointments
+        WHERE date = ?
+        ORDER BY crew
+    """, (fecha,))
+    crews = [r["crew"] for r in c.fetchall()]
+    c.close()
+    return crews
+
+
+def get_crew_day(fecha, crew, branch=None):
+    """Servicios de una cuadrilla en un día, por hora (crew="" = sin cuadrilla)."""
+    return (
+        AppointmentQuery(branch)
+        .date_range(fecha, fecha)
+        .crew(crew)
+        .order_by("time")
+        .fetch()
+    )
+
+
+# ---------- LECTURA CONSOLIDADA (TODAS LAS SUCURSALES) ----------
+
+def _sort_value(r, columna):
+    valor = r[columna] if isinstance(r, sqlite3.Row) else getattr(r, columna)
+    # Los None van al final sin romper la comparación
+    return (valor is None, valor)
+
+
+def federated_query(template, params=(), branches=None, order_by=None,
+                    row_factory=None):
+    """
+    Corre la misma consulta en varias sucursales y junta los resultados.
+
+    `template` es un SELECT con "{schema}" antes de cada tabla, por ejemplo
+    "SELECT date FROM {schema}.appointments WHERE date >= ?". Cada fila
+    trae además la columna `branch` con la sucursal de donde salió.
+
+    Hasta MAX_ATTACHED sucursales se hace con ATTACH y un solo UNION ALL en
+    una conexión; con más, cada sucursal se consulta en un hilo y, si se da
+    `order_by` ("date, time"), las listas ya ordenadas se mezclan con
+    heapq.merge sin volver a ordenar todo.
+
+    `row_factory` (por ejemplo appointment_factory) se llama una vez por
+    cursor para armar registros; sin él se regresan sqlite3.Row.
+    """
+    branches = branches or list_branches()
+    ensure_migrated(branches)
+
+    def parte(branch, schema):
+        return (
+            f"SELECT '{_slug(branch)}' AS branch, q.* "
+            f"FROM ({template.format(schema=schema)}) AS q"
+        )
+
+    if len(branches) <= MAX_ATTACHED + 1:
+        conn = get_conn(branches[0])
+        partes = [parte(branches[0], "main")]
+        for i, branch in enumerate(branches[1:], start=1):
+            conn.execute(f"ATTACH DATABASE ? AS suc{i}", (branch_db_path(branch),))
+            partes.append(parte(branch, f"suc{i}"))
+
+        query = " UNION ALL ".join(partes)
+        if order_by:
+            query = f"SELECT * FROM ({query}) ORDER BY {order_by}"
+        c = conn.cursor()
+        if row_factory:
+            c.row_factory = row_factory()
+        rows = c.execute(query, list(params) * len(partes)).fetchall()
+        conn.close()
+        return rows
+
+    def consultar(branch):
+        conn = get_conn(branch)
+        query = parte(branch, "main")
+        if order_by:
+            query += f" ORDER BY {order_by}"
+        c = conn.cursor()
+        if row_factory:
+            c.row_factory = row_factory()
+        rows = c.execute(query, params).fetchall()
+        conn.close()
+        return rows
+
+    with ThreadPoolExecutor(max_workers=min(8, len(branches))) as pool:
+        listas = list(pool.map(consultar, branches))
+
+    if not order_by:
+        return [r for rows in listas for r in rows]
+    columnas = [col.strip() for col in order_by.split(",")]
+    return list(heapq.merge(
+        *listas, key=lambda r: tuple(_sort_value(r, col) for col in columnas)
+    ))
+
+
+def get_appointments_all_branches(date_from=None, date_to=None, status=None,
+                                  text=None, branches=None):
+    """get_appointments de todas las sucursales, ordenado por fecha y hora."""
+    where, params = (
+        AppointmentQuery()
+        .date_range(date_from, date_to)
+        .status(status)
+        .text(text)
+        .where()
+    )
+    template = (
+        f"SELECT {', '.join(APPOINTMENT_COLUMNS)} FROM {{schema}}.appointments"
+        + where
+    )
+    return federated_query(
+        template, params, branches,
+        order_by="date, time", row_factory=appointment_factory,
+    )
+
+
+def get_calendar_summary_all_branches(date_from, date_to, branches=None):
+    """
+    Resumen por día (servicios, ingresos, estados) sumando todas las
+    sucursales. Cada sucursal resuelve su GROUP BY con su índice y aquí
+    solo se suman los totales de cada día.
+    """
+    template = """
+        SELECT date,
+               COUNT(*) AS total,
+               COALESCE(SUM(price), 0) AS ingresos,
+               SUM(status = 'Pendiente') AS pendientes,
+               SUM(status = 'Confirmado') AS confirmados,
+               SUM(status = 'Realizado') AS realizados,
+               SUM(status = 'Cobrado') AS cobrados
+        FROM {schema}.appointments
+        WHERE date BETWEEN ? AND ?
+        GROUP BY date
+    """
+    campos = ["total", "ingresos", "pendientes", "confirmados", "realizados", "cobrados"]
+    resumen = {}
+    for r in federated_query(template, (date_from, date_to), branches):
+        dia = resumen.setdefault(r["date"], dict.fromkeys(campos, 0))
+        for campo in campos:
+            dia[campo] += r[campo] or 0
+    return resumen
+
+
+# =========================
+# SUBMÓDULOS POR SUCURSAL
+# =========================
+# dedup, recurrence, routes, forecast, jobs y maintenance trabajan sobre una
+# conexión o ruta ya abierta; la app solo conoce la sucursal, así que pasa
+# por estas funciones.
+
+# ---------- DUPLICADOS ----------
+
+def find_client_candidates(name, business_name, phone, exclude_id=None, branch=None):
+    """Clientes que se parecen a uno nuevo (ver dedup.find_candidates)."""
+    return dedup.find_candidates(read_conn(branch), name, business_name, phone, exclude_id)
+
+
+def find_duplicate_groups(branch=None):
+    """Grupos de ids de clientes que parecen ser el mismo."""
+    return dedup.find_duplicate_groups(read_conn(branch))
+
+
+def merge_clients(keep_id, drop_ids, branch=None):
+    """Une `drop_ids` en `keep_id`; regresa cuántos servicios se movieron."""
+    conn = get_conn(branch)
+    try:
+        return dedup.merge_clients(conn, keep_id, drop_ids)
+    finally:
+        conn.close()
+
+
+# ---------- VISITAS MENSUALES ----------
+
+def generate_visits(year, month, branch=None):
+    """Agenda las visitas mensuales del mes; regresa cuántas se crearon."""
+    conn = get_conn(branch)
+    try:
+        return recurrence.generate_month(conn, year, month)
+    finally:
+        conn.close()
+
+
+def preview_visits(desde=None, limit=50, branch=None):
+    """Las próximas `limit` visitas mensuales que todavía no se generan."""
+    return list(itertools.islice(recurrence.preview(read_conn(branch), desde=desde), limit))
+
+
+# ---------- RUTAS ----------
+
+def get_zone_coords(branch=None):
+    """{zona_normalizada: (lat, lon)} de la sucursal."""
+    return routes.get_zone_coords(read_conn(branch))
+
+
+def reload_zone_coords(branch=None):
+    """Vuelve a cargar routes.ZONES_CSV; regresa cuántas zonas se cargaron."""
+    conn = get_conn(branch)
+    try:
+        return routes.seed_zone_coords(conn)
+    finally:
+        conn.close()
+
+
+# ---------- PRONÓSTICO ----------
+
+def get_forecast(semanas, hoy=None, branch=None):
+    """
+    Pronóstico de ingresos y visitas (ver forecast.forecast).
+
+    NumPy se carga hasta aquí, no al importar fx_db.
+    """
+    from . import forecast
+    return forecast.forecast(read_conn(branch), hoy, semanas)
+
+
+# ---------- TRABAJOS EN SEGUNDO PLANO ----------
+
+def submit_export(executor, what, fmt="parquet", incremental=False, branch=None):
+    """
+    Manda un respaldo o exportación al pool y regresa el id del trabajo.
+
+    `what` es "backup" (.db), "excel" o "analysis" (Parquet/Arrow según
+    `fmt`). Excel y el análisis completo pasan por cache.memoized.
+    """
+    from . import cache, export
+    if what == "backup":
+        kind, func, file_name = "Respaldo BD", export.backup_db, "agenda_respaldo.db"
+    elif what == "excel":
+        kind, file_name = "Excel", "agenda_excel.xlsx"
+        func = cache.memoized(export.export_excel, "excel")
+    elif what == "analysis":
+        kind, file_name = "Parquet", f"agenda_{fmt}.zip"
+        if incremental:
+            # El incremental depende de la foto anterior: no se cachea
+            func = functools.partial(export.export_parquet, incremental=True, fmt=fmt)
+        else:
+            func = cache.memoized(export.export_parquet, "parquet", fmt=fmt)
+    else:
+        raise ValueError(f"Exportación desconocida: {what}")
+    return jobs.submit_job(executor, branch_db_path(branch), kind, func, file_name)
+
+
+def get_job(job_id, branch=None):
+    return jobs.get_job(branch_db_path(branch), job_id)
+
+
+def get_recent_jobs(limit=10, branch=None):
+    return jobs.get_recent_jobs(branch_db_path(branch), limit=limit)
+
+
+def mark_interrupted_jobs(branch=None):
+    """Marca como interrumpido lo que quedó corriendo de un arranque previo."""
+    jobs.mark_interrupted(branch_db_path(branch))
+
+
+# ---------- MANTENIMIENTO ----------
+
+def schedule_maintenance(executor, branch=None):
+    """Manda el mantenimiento programado al pool si ya toca."""
+    maintenance.schedule(executor, branch_db_path(branch))
+
+
+def run_maintenance(force=False, convert=False, branch=None):
+    """Mantenimiento completo ahora (ver maintenance.run_maintenance)."""
+    return maintenance.run_maintenance(branch_db_path(branch), force=force, convert=convert)
+
+
+def db_stats(fragmentation=False, branch=None):
+    return maintenance.db_stats(branch_db_path(branch), fragmentation=fragmentation)
+
+
+def replace_db(data, branch=None):
+    """Reemplaza la BD de la sucursal con `data` (bytes de un .db)."""
+    maintenance.replace_db(branch_db_path(branch), data)
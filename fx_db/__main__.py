@@ -0,0 +1,217 @@
+"""
+Línea de comandos de la agenda, sin Streamlit (para cron o el servidor).
+
+    python -m fx_db backup respaldo.db
+    python -m fx_db export excel agenda.xlsx
+    python -m fx_db export parquet analisis.zip --incremental
+    python -m fx_db export excel agenda.xlsx --no-cache
+    python -m fx_db import respaldo.db
+    python -m fx_db status Cobrado --ids 12 13 14
+    python -m fx_db status Confirmado --from 2025-01-01 --to 2025-01-31 --only Pendiente
+    python -m fx_db recurrence --month 2025-02
+    python -m fx_db recurrence --preview 20
+    python -m fx_db stats --client 42
+    python -m fx_db maintenance
+    python -m fx_db forecast --weeks 12
+
+Todas aceptan --branch para trabajar sobre otra sucursal. Las
+exportaciones (openpyxl/pyarrow) y el pronóstico (numpy) se importan solo
+en el comando que las usa.
+"""
+import argparse
+import itertools
+import sys
+from datetime import date
+
+import fx_db
+from fx_db import maintenance, recurrence
+
+
+def _progress(fraccion, mensaje=None):
+    print(f"\r{fraccion:4.0%} {mensaje or ''}".ljust(60), end="", file=sys.stderr, flush=True)
+
+
+def _done():
+    print(file=sys.stderr)
+
+
+def _month(texto):
+    try:
+        anio, mes = texto.split("-")
+        return int(anio), int(mes)
+    except ValueError:
+        raise argparse.ArgumentTypeError("usa el formato YYYY-MM")
+
+
+# ---------- COMANDOS ----------
+
+def cmd_backup(args, db_name):
+    from fx_db import export
+    export.backup_db(db_name, args.output, _progress)
+    _done()
+    print(args.output)
+
+
+def cmd_export(args, db_name):
+    from fx_db import cache, export
+    if args.format == "excel":
+        exportar, params = export.export_excel, {}
+    else:
+        exportar, params = export.export_parquet, {"fmt": args.format}
+        if args.incremental:
+            params["incremental"] = True
+    # El incremental depende de la foto anterior: no se cachea
+    if args.no_cache or args.incremental:
+        exportar(db_name, args.output, _progress, **params)
+    else:
+        kind = "excel" if args.format == "excel" else "parquet"
+        cache.memoized(exportar, kind, **params)(db_name, args.output, _progress)
+    _done()
+    print(args.output)
+
+
+def cmd_import(args, db_name):
+    with open(args.file, "rb") as f:
+        maintenance.replace_db(db_name, f.read())
+    # La BD importada puede venir de una versión anterior
+    fx_db.init_db(args.branch)
+    print(f"Importada en {db_name}")
+
+
+def cmd_status(args, db_name):
+    if args.ids:
+        ids = args.ids
+    elif args.date_from or args.date_to or args.only:
+        query, params = (
+            fx_db.AppointmentQuery(args.branch)
+            .date_range(args.date_from, args.date_to)
+            .status(args.only)
+            .sql("id")
+        )
+        ids = [r[0] for r in fx_db.read_conn(args.branch).execute(query, params)]
+    else:
+        raise SystemExit("Indica --ids o algún filtro (--from, --to, --only)")
+
+    total = fx_db.bulk_update_status(ids, args.new_status, branch=args.branch)
+    print(f"{total} servicio(s) → {args.new_status}")
+
+
+def cmd_recurrence(args, db_name):
+    conn = fx_db.get_conn(args.branch)
+    try:
+        if args.preview:
+            for o in itertools.islice(recurrence.preview(conn), args.preview):
+                print(f"{o.date}  {o.time}  {o.client_name}  ({o.series_key})")
+            return
+        anio, mes = args.month or recurrence.next_month()
+        creadas = recurrence.generate_month(conn, anio, mes)
+        print(f"{creadas} visita(s) generada(s) para {mes:02d}/{anio}")
+    finally:
+        conn.close()
+
+
+def cmd_stats(args, db_name):
+    if args.client:
+        s = fx_db.get_client_stats(args.client, branch=args.branch)
+        print(f"Servicios:       {s.services}")
+        print(f"Visitas hechas:  {s.visits}")
+        print(f"Total cobrado:   {s.revenue:,.2f}")
+        print(f"Por cobrar:      {s.outstanding:,.2f}")
+        print(f"Última visita:   {s.last_visit or '—'}")
+        print(f"Próxima visita:  {s.next_visit or '—'}")
+        return
+
+    conn = fx_db.read_conn(args.branch)
+    clientes = conn.execute("SELECT COUNT(*) FROM clients").fetchone()[0]
+    print(f"Clientes:   {clientes}")
+    for estado, total in conn.execute(
+        "SELECT COALESCE(status, '—'), COUNT(*) FROM appointments GROUP BY status ORDER BY status"
+    ):
+        print(f"  {estado:<12}{total}")
+
+    archivo = maintenance.db_stats(db_name, fragmentation=args.fragmentation)
+    print(f"Archivo:    {archivo['file_size'] / 1024 / 1024:.2f} MB (WAL {archivo['wal_size'] / 1024 / 1024:.2f} MB)")
+    print(f"Libres:     {archivo['free_pages']} de {archivo['page_count']} páginas ({archivo['free_ratio']:.1%})")
+    if archivo["fragmentation"] is not None:
+        print(f"Fragmentación: {archivo['fragmentation']:.1%}")
+    print(f"Último mantenimiento: {archivo['last_run'] or 'nunca'}")
+
+
+def cmd_maintenance(args, db_name):
+    hecho = maintenance.run_maintenance(db_name, force=args.force, convert=True)
+    print(", ".join(hecho) if hecho else "Hay trabajos corriendo; usa --force para hacerlo igual.")
+
+
+def cmd_forecast(args, db_name):
+    from fx_db import forecast
+    pron = forecast.forecast(fx_db.read_conn(args.branch), semanas=args.weeks)
+    print(f"Tasas: Pendiente {pron.rates['Pendiente']:.0%}, Confirmado {pron.rates['Confirmado']:.0%}")
+    for inicio, ingreso, visitas in zip(pron.week_starts(), pron.revenue_week, pron.visits_week):
+        print(f"{inicio}  {ingreso:>12,.2f}  {visitas:6.1f} visitas")
+    print(f"Total       {pron.revenue_day.sum():>12,.2f}  {pron.visits_day.sum():6.1f} visitas")
+
+
+# ---------- ARGUMENTOS ----------
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m fx_db", description="Agenda FX sin interfaz.")
+    parser.add_argument("--branch", default=None, help="sucursal (por defecto la principal)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("backup", help="respaldo consistente de la BD")
+    p.add_argument("output")
+    p.set_defaults(func=cmd_backup)
+
+    p = sub.add_parser("export", help="exportar a Excel / Parquet / Arrow")
+    p.add_argument("format", choices=["excel", "parquet", "arrow"])
+    p.add_argument("output")
+    p.add_argument("--incremental", action="store_true", help="solo meses que cambiaron")
+    p.add_argument("--no-cache", action="store_true", help="exportar aunque no haya cambios")
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser("import", help="reemplazar la BD por un archivo .db")
+    p.add_argument("file")
+    p.set_defaults(func=cmd_import)
+
+    p = sub.add_parser("status", help="cambiar el estado de varios servicios")
+    p.add_argument("new_status", choices=["Pendiente", "Confirmado", "Realizado", "Cobrado"])
+    p.add_argument("--ids", type=int, nargs="+")
+    p.add_argument("--from", dest="date_from", type=date.fromisoformat)
+    p.add_argument("--to", dest="date_to", type=date.fromisoformat)
+    p.add_argument("--only", help="solo los que estén en este estado")
+    p.set_defaults(func=cmd_status)
+
+    p = sub.add_parser("recurrence", help="generar las visitas mensuales")
+    p.add_argument("--month", type=_month, help="YYYY-MM (por defecto el mes siguiente)")
+    p.add_argument("--preview", type=int, metavar="N", help="solo mostrar las próximas N")
+    p.set_defaults(func=cmd_recurrence)
+
+    p = sub.add_parser("stats", help="totales y estado del archivo")
+    p.add_argument("--client", type=int, help="historial de un cliente")
+    p.add_argument("--fragmentation", action="store_true", help="calcular fragmentación (lento)")
+    p.set_defaults(func=cmd_stats)
+
+    p = sub.add_parser(
+        "maintenance",
+        help="ANALYZE / vacuum incremental / checkpoint (convierte BDs viejas con VACUUM)",
+    )
+    p.add_argument("--force", action="store_true", help="aunque haya trabajos corriendo")
+    p.set_defaults(func=cmd_maintenance)
+
+    p = sub.add_parser("forecast", help="ingreso y visitas esperados por semana")
+    p.add_argument("--weeks", type=int, default=8, help="semanas a pronosticar (8)")
+    p.set_defaults(func=cmd_forecast)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    db_name = fx_db.branch_db_path(args.branch)
+    if args.command != "import":
+        fx_db.init_db(args.branch)
+    args.func(args, db_name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+
+from . import get_data_version
+
+# =========================
+# CACHÉ DE EXPORTACIONES
+# =========================
+# Si la agenda no cambió desde la última exportación, el archivo ya hecho
+# sirve igual: se guarda en CACHE_DIR con una llave que sale de
+#
+#   (BD, tipo de exportación, parámetros, versión de los datos)
+#
+# La versión es data_version de fx_db (instancia + contador que suben los
+# triggers en cada escritura de clientes/servicios). PRAGMA data_version no
+# alcanza: solo cambia entre conexiones y se reinicia al reabrir.
+#
+# La carpeta tiene tope de tamaño; al pasarse se borran los archivos que
+# llevan más tiempo sin usarse (cada acierto renueva su mtime).
+
+CACHE_DIR = os.path.join("exports", "cache")
+
+# Tope de la carpeta de caché
+MAX_CACHE_BYTES = 200 * 1024 * 1024
+
+
+def _version(db_name):
+    conn = sqlite3.connect(db_name, timeout=30)
+    try:
+        return get_data_version(conn=conn)
+    finally:
+        conn.close()
+
+
+def cache_key(db_name, kind, version, **params):
+    """Llave estable (sha1) para una exportación."""
+    texto = json.dumps(
+        [os.path.abspath(db_name), kind, version, params],
+        sort_keys=True, default=str,
+    )
+    return hashlib.sha1(texto.encode("utf-8")).hexdigest()
+
+
+def _path(key):
+    return os.path.join(CACHE_DIR, key)
+
+
+def get(key):
+    """Ruta del archivo en caché, o None. Un acierto cuenta como uso."""
+    ruta = _path(key)
+    try:
+        os.utime(ruta)
+    except FileNotFoundError:
+        return None
+    return ruta
+
+
+def put(key, path):
+    """Guarda una copia de `path` en la caché y aplica el tope de tamaño."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    temporal = _path(key) + ".tmp"
+    _link_or_copy(path, temporal)
+    os.replace(temporal, _path(key))
+    evict()
+
+
+def evict(max_bytes=MAX_CACHE_BYTES):
+    """Borra los menos usados hasta quedar bajo `max_bytes`. Regresa cuántos."""
+    try:
+        entradas = [e for e in os.scandir(CACHE_DIR) if e.is_file()]
+    except FileNotFoundError:
+        return 0
+    archivos = sorted((e.stat().st_mtime, e.stat().st_size, e.path) for e in entradas)
+    total = sum(tam for _, tam, _ in archivos)
+    borrados = 0
+    for _, tam, ruta in archivos:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(ruta)
+        except FileNotFoundError:
+            pass
+        total -= tam
+        borrados += 1
+    return borrados
+
+
+def clear():
+    shutil.rmtree(CACHE_DIR, ignore_errors=True)
+
+
+def _link_or_copy(origen, destino):
+    # Un hard link no ocupa espacio extra; si el sistema no lo permite, copia
+    try:
+        os.link(origen, destino)
+    except OSError:
+        shutil.copyfile(origen, destino)
+
+
+# ---------- TRABAJOS CON CACHÉ ----------
+
+def memoized(func, kind, **params):
+    """
+    Envuelve una exportación (db_name, output_path, progress) con la caché.
+
+    Si ya hay un archivo para la versión actual de los datos se entrega ese
+    al instante. Si no, se exporta y se guarda, pero solo si nadie escribió
+    mientras tanto (la versión antes y después es la misma).
+    """
+    def trabajo(db_name, output_path, progress):
+        version = _version(db_name)
+        key = cache_key(db_name, kind, version, **params)
+        en_cache = get(key)
+        if en_cache:
+            _link_or_copy(en_cache, output_path)
+            progress(1.0, "Sin cambios desde la última exportación")
+            return
+
+        func(db_name, output_path, progress, **params)
+        if _version(db_name) == version:
+            put(key, output_path)
+
+    return trabajo
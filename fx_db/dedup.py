@@ -0,0 +1,217 @@
+import re
+import unicodedata
+
+# =========================
+# CLIENTES DUPLICADOS
+# =========================
+# Cada cliente guarda tres "llaves de bloque" normalizadas e indexadas:
+#
+#   phone_key  → solo los últimos 10 dígitos del teléfono
+#   name_key   → nombre sin acentos, mayúsculas, puntuación ni "S.A. de C.V.",
+#                con las palabras ordenadas ("Tacos El Güero" = "el guero tacos")
+#   sound_key  → name_key "como suena" (z/s, v/b, ll/y, sin h ni letras dobles),
+#                para atrapar faltas de ortografía
+#
+# Dos clientes son candidatos a duplicado si comparten cualquiera de las
+# llaves. Buscar es un GROUP BY / búsqueda por índice en cada llave, no una
+# comparación de todos contra todos.
+
+# Palabras que no ayudan a distinguir clientes
+_PALABRAS_VACIAS = {
+    "sa", "de", "cv", "s", "a", "c", "v", "sc", "rl", "sapi", "srl",
+    "el", "la", "los", "las", "y", "del",
+}
+
+# Clientes por vuelta al llenar llaves faltantes
+BACKFILL_BATCH_SIZE = 1000
+
+
+def normalize_text(texto):
+    """'Tacos "El Güero", S.A. de C.V.' → 'el guero tacos' → ver name_key."""
+    if not texto:
+        return ""
+    texto = unicodedata.normalize("NFKD", texto)
+    texto = "".join(ch for ch in texto if not unicodedata.combining(ch))
+    texto = re.sub(r"[^a-z0-9 ]+", " ", texto.lower())
+    return " ".join(texto.split())
+
+
+def name_key(name, business_name=None):
+    """Llave por nombre: el negocio si hay, si no el contacto."""
+    palabras = normalize_text(business_name or name).split()
+    palabras = [p for p in palabras if p not in _PALABRAS_VACIAS]
+    return " ".join(sorted(palabras))
+
+
+def sound_key(clave_nombre):
+    """Versión "fonética" aproximada (español) de un name_key."""
+    if not clave_nombre:
+        return ""
+    texto = clave_nombre
+    for antes, despues in (
+        ("qu", "k"), ("ll", "y"), ("ce", "se"), ("ci", "si"),
+        ("z", "s"), ("v", "b"), ("h", ""), ("x", "ks"), ("w", "u"),
+    ):
+        texto = texto.replace(antes, despues)
+    # Letras dobles → una sola ("Jarrdines" = "Jardines")
+    texto = re.sub(r"(.)\1+", r"\1", texto)
+    return texto.replace(" ", "")
+
+
+def phone_key(phone):
+    """Últimos 10 dígitos ('+52 1 (55) 1234-5678' → '5512345678')."""
+    digitos = re.sub(r"\D", "", phone or "")
+    if len(digitos) < 7:
+        return ""
+    return digitos[-10:]
+
+
+def client_keys(name, business_name, phone):
+    """(name_key, sound_key, phone_key) para guardar junto al cliente."""
+    clave = name_key(name, business_name)
+    return clave, sound_key(clave), phone_key(phone)
+
+
+def init_dedup(conn):
+    """Columnas e índices de las llaves; llena las que falten."""
+    c = conn.cursor()
+    for columna in ("name_key", "sound_key", "phone_key"):
+        try:
+            c.execute(f"ALTER TABLE clients ADD COLUMN {columna} TEXT;")
+        except Exception:
+            # Si ya existe, ignoramos el error
+            pass
+        c.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_clients_{columna} "
+            f"ON clients ({columna}) WHERE {columna} <> '';"
+        )
+    c.execute("CREATE INDEX IF NOT EXISTS idx_clients_sin_llave ON clients (name_key) WHERE name_key IS NULL;")
+
+    # Clientes de antes de tener llaves (o editados por fuera de la app).
+    # Por lotes: cada lote que se llena deja de salir en la siguiente vuelta.
+    while True:
+        c.execute(
+            "SELECT id, name, business_name, phone FROM clients WHERE name_key IS NULL LIMIT ?",
+            (BACKFILL_BATCH_SIZE,),
+        )
+        pendientes = c.fetchall()
+        if not pendientes:
+            break
+        c.executemany(
+            "UPDATE clients SET name_key = ?, sound_key = ?, phone_key = ? WHERE id = ?",
+            [client_keys(r[1], r[2], r[3]) + (r[0],) for r in pendientes],
+        )
+
+
+def find_candidates(conn, name, business_name, phone, exclude_id=None):
+    """
+    Clientes que podrían ser la misma persona/negocio.
+
+    Regresa [(id, etiqueta, teléfono, motivo), ...] usando solo búsquedas
+    por índice en las tres llaves.
+    """
+    clave, sonido, tel = client_keys(name, business_name, phone)
+    candidatos = {}
+    for columna, valor, motivo in (
+        ("phone_key", tel, "mismo teléfono"),
+        ("name_key", clave, "mismo nombre"),
+        ("sound_key", sonido, "nombre parecido"),
+    ):
+        if not valor:
+            continue
+        c = conn.execute(
+            f"SELECT id, COALESCE(NULLIF(business_name, ''), name), phone "
+            f"FROM clients WHERE {columna} = ? AND {columna} <> ''",
+            (valor,),
+        )
+        for client_id, etiqueta, telefono in c.fetchall():
+            if client_id != exclude_id and client_id not in candidatos:
+                candidatos[client_id] = (client_id, etiqueta, telefono, motivo)
+    return list(candidatos.values())
+
+
+def find_duplicate_groups(conn):
+    """
+    Grupos de clientes que comparten alguna llave.
+
+    Un GROUP BY por llave (sobre su índice) y luego se juntan los grupos que
+    tienen clientes en común (union-find). Regresa listas de IDs.
+    """
+    padre = {}
+
+    def raiz(x):
+        while padre.setdefault(x, x) != x:
+            padre[x] = padre[padre[x]]
+            x = padre[x]
+        return x
+
+    for columna in ("phone_key", "name_key", "sound_key"):
+        c = conn.execute(f"""
+            SELECT GROUP_CONCAT(id)
+            FROM clients
+            WHERE {columna} <> ''
+            GROUP BY {columna}
+            HAVING COUNT(*) > 1
+        """)
+        for (ids,) in c.fetchall():
+            ids = [int(i) for i in ids.split(",")]
+            for otro in ids[1:]:
+                padre[raiz(otro)] = raiz(ids[0])
+
+    grupos = {}
+    for client_id in padre:
+        grupos.setdefault(raiz(client_id), []).append(client_id)
+    return sorted((sorted(ids) for ids in grupos.values() if len(ids) > 1), key=lambda g: g[0])
+
+
+def merge_clients(conn, keep_id, drop_ids):
+    """
+    Une varios clientes en `keep_id`.
+
+    Los servicios de los clientes borrados pasan al que se queda (client_id
+    y nombre), los datos que le falten se toman de los otros, y los demás
+    se eliminan. Todo en una transacción. Regresa cuántos servicios se
+    movieron.
+    """
+    drop_ids = [i for i in drop_ids if i != keep_id]
+    if not drop_ids:
+        return 0
+
+    marcas = ",".join("?" * len(drop_ids))
+    with conn:
+        # Completar teléfono, dirección, zona y notas vacíos
+        for columna in ("phone", "address", "zone", "notes"):
+            conn.execute(f"""
+                UPDATE clients
+                SET {columna} = (
+                    SELECT {columna} FROM clients
+                    WHERE id IN ({marcas}) AND COALESCE({columna}, '') <> ''
+                    ORDER BY id LIMIT 1
+                )
+                WHERE id = ? AND COALESCE({columna}, '') = ''
+                  AND EXISTS (
+                    SELECT 1 FROM clients
+                    WHERE id IN ({marcas}) AND COALESCE({columna}, '') <> ''
+                  )
+            """, drop_ids + [keep_id] + drop_ids)
+
+        nombre = conn.execute(
+            "SELECT COALESCE(NULLIF(business_name, ''), name) FROM clients WHERE id = ?",
+            (keep_id,),
+        ).fetchone()[0]
+
+        movidos = conn.execute(
+            f"UPDATE appointments SET client_id = ?, client_name = ? WHERE client_id IN ({marcas})",
+            [keep_id, nombre] + drop_ids,
+        ).rowcount
+        conn.execute(f"DELETE FROM clients WHERE id IN ({marcas})", drop_ids)
+
+        # Las llaves del que se queda pueden haber cambiado (teléfono nuevo)
+        fila = conn.execute(
+            "SELECT name, business_name, phone FROM clients WHERE id = ?", (keep_id,)
+        ).fetchone()
+        conn.execute(
+            "UPDATE clients SET name_key = ?, sound_key = ?, phone_key = ? WHERE id = ?",
+            client_keys(fila[0], fila[1], fila[2]) + (keep_id,),
+        )
+    return movidos
@@ -0,0 +1,273 @@
+import json
+import os
+import shutil
+import sqlite3
+import zipfile
+from dataclasses import fields
+from datetime import datetime
+
+from . import Appointment, AppointmentQuery, Client, iter_appointments, iter_clients
+
+# =========================
+# EXPORTACIONES
+# =========================
+# Funciones pensadas para correr como trabajo en segundo plano (fx_db.jobs):
+# todas reciben (db_name, output_path, progress) y abren su propia conexión.
+#
+# openpyxl/pyarrow se importan DENTRO de cada exportación: cargarlos
+# cuesta más de un segundo y la app no los necesita para arrancar.
+
+# Carpeta con la última foto en Parquet/Arrow de cada BD, particionada por
+# mes: <SNAPSHOTS_DIR>/<bd>/appointments/month=2025-01/part.parquet
+SNAPSHOTS_DIR = os.path.join("exports", "snapshots")
+
+# Filas por lote al leer del cursor y escribir al archivo
+BATCH_SIZE = 5000
+
+
+def export_excel(db_name, output_path, progress):
+    """
+    Clientes y servicios a un .xlsx con una hoja para cada tabla.
+
+    Se escribe con openpyxl en modo write_only, fila por fila desde los
+    generadores de fx_db: la memoria no crece con el tamaño de las tablas.
+    """
+    from openpyxl import Workbook
+
+    conn = sqlite3.connect(db_name, timeout=30)
+    wb = Workbook(write_only=True)
+
+    try:
+        hojas = [
+            ("Clientes", Client, iter_clients(conn=conn)),
+            ("Servicios", Appointment, iter_appointments(
+                AppointmentQuery().order_by("id"), conn=conn,
+            )),
+        ]
+        for i, (titulo, cls, registros) in enumerate(hojas):
+            progress(0.1 + 0.4 * i, f"Escribiendo {titulo.lower()}")
+            columnas = [f.name for f in fields(cls) if f.name != "branch"]
+            ws = wb.create_sheet(titulo)
+            ws.append(columnas)
+            for r in registros:
+                ws.append([getattr(r, col) for col in columnas])
+    finally:
+        conn.close()
+
+    progress(0.9, "Guardando Excel")
+    wb.save(output_path)
+
+
+def backup_db(db_name, output_path, progress):
+    """
+    Copia consistente de la BD con la API de respaldo de SQLite.
+
+    Se copia en un solo paso (pages=-1). Por bloques, cualquier escritura
+    de otra conexión (incluido el avance de este mismo trabajo en la tabla
+    jobs) hace que SQLite reinicie la copia desde cero y con una BD grande
+    no termina nunca; por eso solo se reporta el inicio y el final.
+    """
+    src = sqlite3.connect(db_name, timeout=30)
+    dst = sqlite3.connect(output_path)
+
+    progress(0.1, "Copiando base de datos")
+    with dst:
+        src.backup(dst, pages=-1)
+
+    # La copia viene en modo WAL como la original; se deja como un solo
+    # archivo autocontenido para descargarla
+    dst.execute("PRAGMA journal_mode = DELETE")
+    dst.close()
+    src.close()
+
+
+# ---------- PARQUET / ARROW ----------
+
+def _arrow_schemas(pa):
+    clients = pa.schema([
+        ("id", pa.int64()),
+        ("name", pa.string()),
+        ("business_name", pa.string()),
+        ("address", pa.string()),
+        ("zone", pa.string()),
+        ("phone", pa.string()),
+        ("notes", pa.string()),
+        ("is_monthly", pa.bool_()),
+        ("monthly_day", pa.int8()),
+    ])
+    appointments = pa.schema([
+        ("id", pa.int64()),
+        ("client_id", pa.int64()),
+        ("client_name", pa.string()),
+        ("service_type", pa.string()),
+        ("pest_type", pa.string()),
+        ("address", pa.string()),
+        ("zone", pa.string()),
+        ("phone", pa.string()),
+        ("date", pa.date32()),
+        ("time", pa.time32("s")),
+        ("price", pa.float64()),
+        ("status", pa.string()),
+        ("notes", pa.string()),
+        ("created_at", pa.timestamp("s")),
+        ("is_monthly_service", pa.bool_()),
+        ("crew", pa.string()),
+    ])
+    return clients, appointments
+
+
+def _parse_created_at(valor):
+    try:
+        return datetime.fromisoformat(valor) if valor else None
+    except ValueError:
+        return None
+
+
+def _write_table(pa, fmt, path, schema, lotes, to_row):
+    """
+    Escribe a un archivo los lotes de registros de `lotes`.
+
+    `lotes` es un generador de fx_db con batches=True, así nunca se tiene
+    en memoria más de BATCH_SIZE filas. `to_row` convierte cada registro a
+    la tupla de columnas del esquema.
+    """
+    nombres = schema.names
+    if fmt == "arrow":
+        writer = pa.ipc.new_file(path, schema)
+    else:
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(path, schema, compression="zstd")
+
+    filas = 0
+    try:
+        for lote in lotes:
+            columnas = list(zip(*(to_row(r) for r in lote)))
+            writer.write_batch(pa.RecordBatch.from_arrays(
+                [pa.array(col, type=schema.field(n).type) for n, col in zip(nombres, columnas)],
+                schema=schema,
+            ))
+            filas += len(lote)
+    finally:
+        lotes.close()
+        writer.close()
+    return filas
+
+
+def _snapshot_format(manifiesto_path):
+    """Formato de la foto anterior según su manifest.json (None si no hay)."""
+    try:
+        with open(manifiesto_path, encoding="utf-8") as f:
+            return json.load(f).get("format")
+    except (OSError, ValueError):
+        return None
+
+
+def export_parquet(db_name, output_path, progress, incremental=False, fmt="parquet"):
+    """
+    Foto de clientes y servicios en Parquet (o Arrow IPC con fmt="arrow").
+
+    Los servicios se parten por mes (month=YYYY-MM). En modo incremental
+    solo se reescriben los meses que cambiaron desde la foto anterior (tabla
+    changed_months, que llenan los triggers de fx_db); la primera vez, o si
+    la foto anterior fue del otro formato, siempre es completa. El archivo de salida es un .zip con lo que se escribió en
+    esta corrida: para actualizar una copia local basta con descomprimirlo
+    encima.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.ipc  # noqa: F401
+    except ImportError:
+        raise RuntimeError("Para exportar a Parquet/Arrow instala pyarrow (pip install pyarrow)")
+
+    extension = "arrow" if fmt == "arrow" else "parquet"
+    schema_clients, schema_appointments = _arrow_schemas(pa)
+
+    carpeta = os.path.join(SNAPSHOTS_DIR, os.path.splitext(os.path.basename(db_name))[0])
+    manifiesto_path = os.path.join(carpeta, "manifest.json")
+    if incremental and _snapshot_format(manifiesto_path) != fmt:
+        # La foto (y changed_months) es una sola para los dos formatos: si
+        # la anterior fue del otro formato, los meses sin cambios no están
+        # en este y hay que empezar de cero
+        incremental = False
+    if not incremental:
+        shutil.rmtree(carpeta, ignore_errors=True)
+    os.makedirs(os.path.join(carpeta, "appointments"), exist_ok=True)
+
+    conn = sqlite3.connect(db_name, timeout=30)
+
+    # Se toman y borran los meses pendientes ANTES de leer: si algo cambia
+    # mientras exportamos, el trigger lo vuelve a marcar para la próxima.
+    with conn:
+        if incremental:
+            meses = [m for (m,) in conn.execute("SELECT month FROM changed_months ORDER BY month")]
+        else:
+            meses = [m for (m,) in conn.execute(
+                "SELECT DISTINCT substr(date, 1, 7) FROM appointments ORDER BY 1"
+            )]
+        conn.execute("DELETE FROM changed_months")
+
+    escritos = []
+    try:
+        progress(0.05, "Clientes")
+        ruta = os.path.join(carpeta, f"clients.{extension}")
+        lotes = iter_clients(batch_size=BATCH_SIZE, batches=True, conn=conn)
+        _write_table(
+            pa, fmt, ruta, schema_clients, lotes,
+            to_row=lambda r: (
+                r.id, r.name, r.business_name, r.address, r.zone, r.phone,
+                r.notes, bool(r.is_monthly), r.monthly_day,
+            ),
+        )
+        escritos.append(ruta)
+
+        for i, mes in enumerate(meses, start=1):
+            progress(0.1 + 0.8 * i / max(len(meses), 1), f"Servicios {mes}")
+            carpeta_mes = os.path.join(carpeta, "appointments", f"month={mes}")
+            shutil.rmtree(carpeta_mes, ignore_errors=True)
+
+            lotes = (
+                AppointmentQuery()
+                .date_range(f"{mes}-01", f"{mes}-31")
+                .order_by("date", "time", "id")
+                .iter(BATCH_SIZE, batches=True, conn=conn)
+            )
+            os.makedirs(carpeta_mes)
+            ruta = os.path.join(carpeta_mes, f"part.{extension}")
+            filas = _write_table(
+                pa, fmt, ruta, schema_appointments, lotes,
+                to_row=lambda r: (
+                    r.id, r.client_id, r.client_name, r.service_type, r.pest_type,
+                    r.address, r.zone, r.phone, r.date, r.time, r.price, r.status,
+                    r.notes, _parse_created_at(r.created_at), bool(r.is_monthly_service),
+                    r.crew,
+                ),
+            )
+            if filas:
+                escritos.append(ruta)
+            else:
+                # Mes que se quedó sin servicios (se borraron todos)
+                shutil.rmtree(carpeta_mes, ignore_errors=True)
+    except Exception:
+        # Devolver los meses pendientes para no perderlos en la próxima
+        with conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO changed_months (month) VALUES (?)",
+                [(m,) for m in meses],
+            )
+        conn.close()
+        raise
+    conn.close()
+
+    with open(manifiesto_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "format": fmt,
+            "incremental": incremental,
+            "months": meses,
+        }, f, indent=2)
+    escritos.append(manifiesto_path)
+
+    progress(0.95, "Comprimiendo")
+    with zipfile.ZipFile(output_path, "w", compression=zipfile.ZIP_STORED) as zf:
+        for ruta in escritos:
+            zf.write(ruta, os.path.relpath(ruta, carpeta))
@@ -0,0 +1,175 @@
+import itertools
+from dataclasses import dataclass
+from datetime import date, timedelta
+
+from . import recurrence, routes
+
+# =========================
+# PRONÓSTICO DE INGRESOS Y CARGA DE TRABAJO
+# =========================
+# Junta lo que ya está agendado con las visitas mensuales que todavía no se
+# generan (recurrence.preview) y lo pasa a arreglos de NumPy: día, zona,
+# estado y precio de cada servicio. Cada uno pesa su probabilidad de
+# hacerse según el historial de su estado, y los totales por día, semana y
+# zona salen con np.bincount, sin ciclos en Python.
+#
+# NumPy se importa DENTRO de forecast(), igual que openpyxl/pyarrow en
+# export.py: la app no lo necesita para arrancar.
+
+# Semanas a pronosticar por defecto
+HORIZON_WEEKS = 8
+
+# Historial para calcular las tasas de cumplimiento
+HISTORY_DAYS = 365
+
+# Estados en el orden de su código en los arreglos
+STATUSES = ["Pendiente", "Confirmado", "Realizado", "Cobrado"]
+
+# Sin historial suficiente se supone que todo lo agendado se hace
+DEFAULT_RATE = 1.0
+
+# Zona para servicios que no la tienen
+SIN_ZONA = "Sin zona"
+
+
+@dataclass(slots=True)
+class Forecast:
+    start: date
+    weeks: int
+    zones: list
+    rates: dict
+    revenue_day: object       # ndarray (días,)
+    visits_day: object        # ndarray (días,), visitas esperadas
+    revenue_zone_week: object  # ndarray (zonas, semanas)
+    visits_zone_week: object   # ndarray (zonas, semanas)
+    scheduled: int = 0
+    recurring: int = 0
+
+    @property
+    def revenue_week(self):
+        return self.revenue_zone_week.sum(axis=0)
+
+    @property
+    def visits_week(self):
+        return self.visits_zone_week.sum(axis=0)
+
+    def week_starts(self):
+        return [self.start + timedelta(weeks=i) for i in range(self.weeks)]
+
+
+def completion_rates(conn, hoy=None, dias=HISTORY_DAYS):
+    """
+    Probabilidad de que un servicio en cada estado llegue a hacerse.
+
+    Un servicio ya pasado que sigue "Pendiente" o "Confirmado" no se hizo;
+    uno "Realizado" o "Cobrado" sí. La tasa de un estado es
+    hechos / (hechos + vencidos en ese estado) en los últimos `dias` días.
+    Realizado y Cobrado valen 1.
+    """
+    hoy = hoy or date.today()
+    conteo = dict(conn.execute("""
+        SELECT status, COUNT(*) FROM appointments
+        WHERE date >= ? AND date < ?
+        GROUP BY status
+    """, (str(hoy - timedelta(days=dias)), str(hoy))).fetchall())
+    hechos = conteo.get("Realizado", 0) + conteo.get("Cobrado", 0)
+
+    rates = {"Realizado": 1.0, "Cobrado": 1.0}
+    for estado in ("Pendiente", "Confirmado"):
+        total = hechos + conteo.get(estado, 0)
+        rates[estado] = hechos / total if total else DEFAULT_RATE
+    return rates
+
+
+def _scheduled(conn, hoy, fin):
+    """(día desde hoy, zona, código de estado, precio) de lo ya agendado."""
+    return conn.execute("""
+        SELECT CAST(julianday(date) - julianday(?) AS INTEGER),
+               COALESCE(NULLIF(zone, ''), ?),
+               CASE status
+                   WHEN 'Confirmado' THEN 1
+                   WHEN 'Realizado' THEN 2
+                   WHEN 'Cobrado' THEN 3
+                   ELSE 0
+               END,
+               COALESCE(price, 0)
+        FROM appointments
+        WHERE date >= ? AND date < ?
+    """, (str(hoy), SIN_ZONA, str(hoy), str(fin))).fetchall()
+
+
+def _recurring(conn, hoy, fin):
+    """Lo mismo para las visitas mensuales que faltan generar (Pendiente)."""
+    meses = (fin.year - hoy.year) * 12 + fin.month - hoy.month + 1
+    visitas = itertools.takewhile(
+        lambda o: o.date < fin, recurrence.preview(conn, desde=hoy, meses=meses)
+    )
+    return [
+        ((o.date - hoy).days, o.zone or SIN_ZONA, 0, o.price or 0)
+        for o in visitas
+        if o.date >= hoy
+    ]
+
+
+def _sum_by(np, indices, pesos, n):
+    # bincount regresa enteros si no hay datos; siempre float para la gráfica
+    return np.bincount(indices, weights=pesos, minlength=n).astype(np.float64)
+
+
+def forecast(conn, hoy=None, semanas=HORIZON_WEEKS):
+    """
+    Ingreso y visitas esperados desde `hoy` por `semanas` semanas.
+
+    Las semanas son bloques de 7 días a partir de hoy (semana 0 = hoy a
+    hoy + 6). Regresa un Forecast con los totales por día y por zona/semana.
+    """
+    import numpy as np
+
+    hoy = hoy or date.today()
+    dias = semanas * 7
+    fin = hoy + timedelta(days=dias)
+
+    rates = completion_rates(conn, hoy)
+    agendados = _scheduled(conn, hoy, fin)
+    mensuales = _recurring(conn, hoy, fin)
+    filas = agendados + mensuales
+
+    if filas:
+        dia, zona, estado, precio = zip(*filas)
+    else:
+        dia = zona = estado = precio = ()
+    dia = np.asarray(dia, dtype=np.int64)
+    estado = np.asarray(estado, dtype=np.int64)
+    precio = np.asarray(precio, dtype=np.float64)
+
+    # Zonas: "Centro", "centro " y "Col. Centro" son la misma
+    # (routes.normalize_zone). Solo se normalizan los textos distintos y
+    # el resultado se reparte con los índices de np.unique.
+    crudas, cruda_idx = np.unique(np.asarray(zona, dtype=object), return_inverse=True)
+    claves = [routes.normalize_zone(z) or routes.normalize_zone(SIN_ZONA) for z in crudas]
+    claves_unicas, clave_idx = np.unique(np.asarray(claves, dtype=object), return_inverse=True)
+    zona = clave_idx.reshape(-1)[cruda_idx.reshape(-1)].astype(np.int64)
+    # Se muestra la primera forma escrita de cada zona
+    etiquetas = {}
+    for cruda, clave in zip(crudas, claves):
+        etiquetas.setdefault(clave, cruda.strip() or SIN_ZONA)
+
+    # Peso de cada servicio = tasa de su estado
+    peso = np.array([rates[s] for s in STATUSES])[estado]
+    ingreso = precio * peso
+
+    semana = dia // 7
+    celda = zona * semanas + semana
+    total_celdas = len(claves_unicas) * semanas
+    return Forecast(
+        start=hoy,
+        weeks=semanas,
+        zones=[etiquetas[c] for c in claves_unicas],
+        rates=rates,
+        revenue_day=_sum_by(np, dia, ingreso, dias),
+        visits_day=_sum_by(np, dia, peso, dias),
+        revenue_zone_week=_sum_by(np, celda, ingreso, total_celdas).reshape(-1, semanas),
+        visits_zone_week=_sum_by(np, celda, peso, total_celdas).reshape(-1, semanas),
+        scheduled=len(agendados),
+        recurring=len(mensuales),
+    )
@@ -0,0 +1,180 @@
+import os
+import sqlite3
+import traceback
+from datetime import datetime
+
+# =========================
+# TRABAJOS EN SEGUNDO PLANO
+# =========================
+# Exportaciones, respaldos y tareas pesadas corren en un pool de hilos
+# compartido por todo el proceso (lo crea app.py con st.cache_resource).
+# El estado de cada trabajo se guarda en la tabla `jobs`, así que sobrevive
+# a un refresh del navegador: la pantalla solo consulta la tabla.
+
+JOBS_DIR = "exports"
+
+ESTADO_EN_COLA = "En cola"
+ESTADO_EN_PROCESO = "En proceso"
+ESTADO_LISTO = "Listo"
+ESTADO_ERROR = "Error"
+ESTADO_INTERRUMPIDO = "Interrumpido"
+
+# Trabajos (y sus archivos en JOBS_DIR) que se conservan por BD; los más
+# viejos se borran al mandar uno nuevo
+JOBS_KEEP = 20
+
+
+def _connect(db_name):
+    # Los hilos escriben progreso mientras la app también escribe;
+    # esperamos el lock en vez de fallar con "database is locked".
+    conn = sqlite3.connect(db_name, timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def init_jobs_table(conn):
+    """Crea la tabla de trabajos si no existe."""
+    c = conn.cursor()
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            status TEXT NOT NULL,
+            progress REAL DEFAULT 0,
+            message TEXT,
+            output_path TEXT,
+            file_name TEXT,
+            error TEXT,
+            created_at TEXT,
+            started_at TEXT,
+            finished_at TEXT
+        );
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs (created_at);")
+
+
+def mark_interrupted(db_name):
+    """
+    Marca como interrumpidos los trabajos que quedaron a medias.
+
+    Se llama una sola vez al crear el pool: si el proceso se reinició,
+    nadie va a terminar esos trabajos.
+    """
+    conn = _connect(db_name)
+    init_jobs_table(conn)
+    conn.execute(
+        "UPDATE jobs SET status = ?, finished_at = ? WHERE status IN (?, ?)",
+        (ESTADO_INTERRUMPIDO, _now(), ESTADO_EN_COLA, ESTADO_EN_PROCESO),
+    )
+    conn.commit()
+    conn.close()
+    purge_old_jobs(db_name)
+
+
+def _output_path(db_name, job_id, file_name):
+    # El prefijo de la BD evita choques de IDs entre sucursales
+    prefijo = os.path.splitext(os.path.basename(db_name))[0]
+    return os.path.join(JOBS_DIR, f"{prefijo}_{job_id}_{file_name}")
+
+
+def purge_old_jobs(db_name, keep=JOBS_KEEP):
+    """
+    Borra los trabajos terminados más allá de los `keep` más recientes,
+    junto con su archivo. Regresa cuántos se borraron.
+    """
+    conn = _connect(db_name)
+    viejos = conn.execute("""
+        SELECT id, file_name FROM jobs
+        WHERE id <= (SELECT MAX(id) FROM jobs) - ?
+          AND status NOT IN (?, ?)
+    """, (keep, ESTADO_EN_COLA, ESTADO_EN_PROCESO)).fetchall()
+    for job in viejos:
+        # También los de trabajos con error, que pueden dejar un archivo a medias
+        try:
+            os.remove(_output_path(db_name, job["id"], job["file_name"]))
+        except FileNotFoundError:
+            pass
+    conn.executemany("DELETE FROM jobs WHERE id = ?", [(job["id"],) for job in viejos])
+    conn.commit()
+    conn.close()
+    return len(viejos)
+
+
+def submit_job(executor, db_name, kind, func, file_name):
+    """
+    Registra un trabajo y lo manda al pool.
+
+    `func(db_name, output_path, progress)` hace el trabajo real y escribe
+    su resultado en `output_path`; `progress(fraccion, mensaje)` actualiza
+    la barra de avance. Regresa el ID del trabajo.
+    """
+    conn = _connect(db_name)
+    c = conn.cursor()
+    c.execute("""
+        INSERT INTO jobs (kind, status, progress, file_name, created_at)
+        VALUES (?, ?, 0, ?, ?)
+    """, (kind, ESTADO_EN_COLA, file_name, _now()))
+    job_id = c.lastrowid
+    conn.commit()
+    conn.close()
+    purge_old_jobs(db_name)
+
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    output_path = _output_path(db_name, job_id, file_name)
+    executor.submit(_run_job, db_name, job_id, func, output_path)
+    return job_id
+
+
+def _run_job(db_name, job_id, func, output_path):
+    conn = _connect(db_name)
+    conn.execute(
+        "UPDATE jobs SET status = ?, started_at = ? WHERE id = ?",
+        (ESTADO_EN_PROCESO, _now(), job_id),
+    )
+    conn.commit()
+
+    def progress(fraccion, mensaje=None):
+        conn.execute(
+            "UPDATE jobs SET progress = ?, message = ? WHERE id = ?",
+            (max(0.0, min(1.0, fraccion)), mensaje, job_id),
+        )
+        conn.commit()
+
+    try:
+        func(db_name, output_path, progress)
+    except Exception:
+        conn.execute(
+            "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+            (ESTADO_ERROR, traceback.format_exc(limit=5), _now(), job_id),
+        )
+    else:
+        conn.execute("""
+            UPDATE jobs
+            SET status = ?, progress = 1, output_path = ?, finished_at = ?
+            WHERE id = ?
+        """, (ESTADO_LISTO, output_path, _now(), job_id))
+    conn.commit()
+    conn.close()
+
+
+def get_job(db_name, job_id):
+    conn = _connect(db_name)
+    c = conn.cursor()
+    c.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+    row = c.fetchone()
+    conn.close()
+    return row
+
+
+def get_recent_jobs(db_name, limit=10):
+    """Últimos trabajos, del más nuevo al más viejo."""
+    conn = _connect(db_name)
+    c = conn.cursor()
+    c.execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,))
+    rows = c.fetchall()
+    conn.close()
+    return rows
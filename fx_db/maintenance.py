@@ -0,0 +1,267 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+from . import jobs
+
+# =========================
+# MANTENIMIENTO DE LA BD
+# =========================
+# La BD trabaja en modo WAL y con auto_vacuum=INCREMENTAL. Cada tanto (y
+# solo si no hay trabajos corriendo) se hace en segundo plano:
+#
+#   - PRAGMA optimize, o ANALYZE completo si las estadísticas son viejas
+#   - incremental_vacuum de a pocos (MAX_VACUUM_PAGES) para regresar al
+#     disco las páginas que dejaron los borrados, sin bloquear a la app
+#   - checkpoint del WAL
+#
+# Las BDs nuevas nacen con auto_vacuum=INCREMENTAL (init_db lo fija antes
+# de crear tablas). Una BD vieja necesita UN VACUUM completo para
+# convertirse, que bloquea las escrituras mientras dura: eso nunca corre
+# solo, únicamente desde el botón del panel o `python -m fx_db maintenance`.
+
+# Cada cuánto se revisa una BD
+MAINTENANCE_EVERY = timedelta(minutes=30)
+
+# ANALYZE completo cada tanto; entre uno y otro basta PRAGMA optimize
+ANALYZE_EVERY = timedelta(days=7)
+
+# Páginas que se liberan por corrida (4 KB c/u → ~8 MB)
+MAX_VACUUM_PAGES = 2000
+
+# BD con auto_vacuum=INCREMENTAL
+AUTO_VACUUM_INCREMENTAL = 2
+
+# BDs con mantenimiento en curso en este proceso
+_en_curso = set()
+_lock = threading.Lock()
+
+
+def _connect(db_name):
+    return sqlite3.connect(db_name, timeout=30, isolation_level=None)
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def init_maintenance(conn):
+    """Modo WAL y tabla con la última corrida de cada tarea."""
+    conn.execute("PRAGMA journal_mode = WAL;")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS maintenance (
+            task TEXT PRIMARY KEY,
+            last_run TEXT,
+            detail TEXT
+        );
+    """)
+    conn.commit()
+
+
+def _last_run(conn, task):
+    fila = conn.execute("SELECT last_run FROM maintenance WHERE task = ?", (task,)).fetchone()
+    return datetime.fromisoformat(fila[0]) if fila and fila[0] else None
+
+
+def _record(conn, task, detail):
+    conn.execute(
+        "INSERT OR REPLACE INTO maintenance (task, last_run, detail) VALUES (?, ?, ?)",
+        (task, _now(), detail),
+    )
+
+
+def schedule(executor, db_name):
+    """
+    Manda el mantenimiento al pool si ya toca.
+
+    Se llama en cada carga de la página; casi siempre solo lee una fila y
+    regresa. Regresa True si se mandó.
+    """
+    conn = _connect(db_name)
+    try:
+        ultima = _last_run(conn, "mantenimiento")
+    except sqlite3.OperationalError:
+        # BD sin la tabla todavía (se crea en init_db)
+        ultima = None
+    conn.close()
+    if ultima and datetime.now() - ultima < MAINTENANCE_EVERY:
+        return False
+
+    with _lock:
+        if db_name in _en_curso:
+            return False
+        _en_curso.add(db_name)
+    executor.submit(_run_scheduled, db_name)
+    return True
+
+
+def _run_scheduled(db_name):
+    try:
+        run_maintenance(db_name)
+    finally:
+        with _lock:
+            _en_curso.discard(db_name)
+
+
+def _busy(conn):
+    """¿Hay exportaciones o respaldos corriendo? Entonces no es buen momento."""
+    try:
+        return conn.execute(
+            "SELECT 1 FROM jobs WHERE status IN (?, ?) LIMIT 1",
+            (jobs.ESTADO_EN_COLA, jobs.ESTADO_EN_PROCESO),
+        ).fetchone() is not None
+    except sqlite3.OperationalError:
+        return False
+
+
+def run_maintenance(db_name, force=False, convert=False):
+    """
+    Una corrida de mantenimiento. Regresa lista de lo que se hizo.
+
+    Sin `force` se salta si hay trabajos en segundo plano corriendo (se
+    vuelve a intentar en la próxima carga de la página). Con `convert` una
+    BD vieja se convierte a auto_vacuum incremental (VACUUM completo).
+    """
+    conn = _connect(db_name)
+    hecho = []
+    try:
+        if not force and _busy(conn):
+            return hecho
+
+        # Conversión única a auto_vacuum incremental (necesita VACUUM)
+        if convert and conn.execute("PRAGMA auto_vacuum").fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+            hecho.append("VACUUM (conversión a auto_vacuum incremental)")
+
+        # Estadísticas del planeador
+        ultimo_analyze = _last_run(conn, "analyze")
+        if not ultimo_analyze or datetime.now() - ultimo_analyze > ANALYZE_EVERY:
+            conn.execute("PRAGMA analysis_limit = 1000")
+            conn.execute("ANALYZE")
+            _record(conn, "analyze", "")
+            hecho.append("ANALYZE")
+        else:
+            conn.execute("PRAGMA optimize")
+            hecho.append("optimize")
+
+        # Regresar páginas libres al disco, de a poco
+        libres = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if libres:
+            conn.execute(f"PRAGMA incremental_vacuum({min(libres, MAX_VACUUM_PAGES)})")
+            hecho.append(f"incremental_vacuum ({min(libres, MAX_VACUUM_PAGES)} páginas)")
+
+        checkpoint(conn)
+        hecho.append("checkpoint WAL")
+
+        _record(conn, "mantenimiento", ", ".join(hecho))
+    finally:
+        conn.close()
+    return hecho
+
+
+def checkpoint(conn, mode="PASSIVE"):
+    """
+    Pasa el WAL al archivo .db.
+
+    PASSIVE no espera a nadie; TRUNCATE (antes de copiar o reemplazar el
+    archivo) espera a los lectores y deja el -wal en cero.
+    """
+    return conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+
+
+# ---------- ESTADO PARA EL PANEL ----------
+
+def db_stats(db_name, fragmentation=False):
+    """
+    Tamaño y espacio libre de la BD.
+
+    La fragmentación (hojas consecutivas de una misma tabla o índice que no
+    quedaron seguidas en el archivo; el salto de la raíz a sus hijas no
+    cuenta) se calcula con dbstat y lee todo el archivo, así que
+    solo se calcula si se pide. Queda en None si este SQLite no trae dbstat.
+    """
+    conn = _connect(db_name)
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    stats = {
+        "file_size": os.path.getsize(db_name) if os.path.exists(db_name) else 0,
+        "wal_size": os.path.getsize(db_name + "-wal") if os.path.exists(db_name + "-wal") else 0,
+        "page_size": page_size,
+        "page_count": page_count,
+        "free_pages": freelist,
+        "free_ratio": freelist / page_count if page_count else 0.0,
+        "journal_mode": conn.execute("PRAGMA journal_mode").fetchone()[0],
+        "auto_vacuum": conn.execute("PRAGMA auto_vacuum").fetchone()[0] == AUTO_VACUUM_INCREMENTAL,
+        "fragmentation": None,
+        "last_run": None,
+        "last_detail": None,
+    }
+    try:
+        fila = conn.execute(
+            "SELECT last_run, detail FROM maintenance WHERE task = 'mantenimiento'"
+        ).fetchone()
+        if fila:
+            stats["last_run"], stats["last_detail"] = fila
+    except sqlite3.OperationalError:
+        pass
+
+    if fragmentation:
+        try:
+            saltos, total = conn.execute("""
+                SELECT SUM(pageno <> anterior + 1), COUNT(*)
+                FROM (
+                    SELECT pageno,
+                           LAG(pageno) OVER (PARTITION BY name ORDER BY path) AS anterior
+                    FROM dbstat
+                    WHERE pagetype = 'leaf'
+                )
+                WHERE anterior IS NOT NULL
+            """).fetchone()
+            stats["fragmentation"] = (saltos or 0) / total if total else 0.0
+        except sqlite3.OperationalError:
+            pass
+    conn.close()
+    return stats
+
+
+# ---------- IMPORTAR CON WAL ----------
+
+def replace_db(db_name, data):
+    """
+    Reemplaza el archivo de la BD por `data` (bytes de un .db).
+
+    Primero se vacía el WAL de la BD actual; el archivo nuevo se escribe
+    aparte y se cambia con os.replace (así read_conn ve el inodo nuevo y
+    reabre), y se borran el -wal/-shm viejos para que SQLite no intente
+    aplicarlos sobre la BD importada.
+    """
+    if not data.startswith(b"SQLite format 3\x00"):
+        raise ValueError("El archivo no es una base de datos SQLite")
+
+    if os.path.exists(db_name):
+        conn = _connect(db_name)
+        checkpoint(conn, "TRUNCATE")
+        conn.close()
+
+    temporal = db_name + ".importando"
+    with open(temporal, "wb") as f:
+        f.write(data)
+    os.replace(temporal, db_name)
+    for extra in ("-wal", "-shm"):
+        try:
+            os.remove(db_name + extra)
+        except FileNotFoundError:
+            pass
+
+    # Otra "instancia" de datos: sus números de versión no son comparables
+    # con los de la BD anterior (cachés de exportación, ver fx_db.cache)
+    conn = _connect(db_name)
+    try:
+        conn.execute("UPDATE data_version SET instance = lower(hex(randomblob(8)))")
+    except sqlite3.OperationalError:
+        # BD de antes de data_version; init_db la crea con instancia nueva
+        pass
+    conn.close()
@@ -0,0 +1,261 @@
+import calendar
+from dataclasses import dataclass, replace
+from datetime import date, datetime, timedelta
+
+# =========================
+# SERVICIOS RECURRENTES (MENSUALES)
+# =========================
+# Genera las visitas del mes para dos tipos de "serie":
+#
+#   client:<id>  → cliente mensual (clients.is_monthly + monthly_day); copia
+#                  tipo, plaga, hora, precio y cuadrilla de su último servicio
+#   appt:<id>    → servicio marcado como mensual (is_monthly_service); el
+#                  servicio original es la primera visita y el día del mes
+#                  sale de su fecha
+#
+# Cada visita generada guarda (series_key, period = "YYYY-MM") con un índice
+# UNIQUE, así generar el mismo mes dos veces no duplica nada (INSERT OR
+# IGNORE). Todo el mes se inserta en una sola transacción.
+
+# Estado de las visitas generadas
+STATUS_NUEVO = "Pendiente"
+
+# Hora si el cliente mensual todavía no tiene ningún servicio
+HORA_DEFAULT = "09:00"
+
+
+@dataclass(slots=True)
+class Occurrence:
+    series_key: str
+    period: str
+    date: date
+    time: str
+    client_id: int = None
+    client_name: str = None
+    service_type: str = None
+    pest_type: str = None
+    address: str = None
+    zone: str = None
+    phone: str = None
+    price: float = None
+    crew: str = None
+    notes: str = None
+
+
+def init_recurrence(conn):
+    """Columnas de serie/periodo y su índice único."""
+    c = conn.cursor()
+    for columna in ("series_key", "period"):
+        try:
+            c.execute(f"ALTER TABLE appointments ADD COLUMN {columna} TEXT;")
+        except Exception:
+            # Si ya existe, ignoramos el error
+            pass
+    c.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_appointments_serie "
+        "ON appointments (series_key, period) WHERE series_key IS NOT NULL;"
+    )
+
+
+def visit_date(year, month, day):
+    """
+    Fecha de la visita del mes.
+
+    El día se recorta al último del mes (31 → 30 o 28/29). Si cae en
+    sábado o domingo pasa al lunes; si ese lunes ya es del mes siguiente,
+    se adelanta al viernes.
+    """
+    ultimo = calendar.monthrange(year, month)[1]
+    fecha = date(year, month, max(1, min(day, ultimo)))
+    if fecha.weekday() >= 5:
+        lunes = fecha + timedelta(days=7 - fecha.weekday())
+        if lunes.month == month:
+            return lunes
+        return fecha - timedelta(days=fecha.weekday() - 4)
+    return fecha
+
+
+def next_month(hoy=None):
+    """(año, mes) del mes siguiente a `hoy`."""
+    hoy = hoy or date.today()
+    return (hoy.year + 1, 1) if hoy.month == 12 else (hoy.year, hoy.month + 1)
+
+
+# ---------- SERIES ----------
+
+def _client_series(conn):
+    """Clientes mensuales con los datos de su último servicio."""
+    c = conn.execute("""
+        SELECT cl.id, cl.monthly_day,
+               COALESCE(NULLIF(cl.business_name, ''), cl.name),
+               cl.business_name, cl.address, cl.zone, cl.phone,
+               u.service_type, u.pest_type, u.time, u.price, u.crew
+        FROM clients cl
+        LEFT JOIN (
+            SELECT client_id, service_type, pest_type, time, price, crew,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY client_id ORDER BY date DESC, id DESC
+                   ) AS rn
+            FROM appointments
+            WHERE client_id IN (SELECT id FROM clients WHERE is_monthly = 1)
+        ) u ON u.client_id = cl.id AND u.rn = 1
+        WHERE cl.is_monthly = 1 AND cl.monthly_day BETWEEN 1 AND 31
+        ORDER BY cl.id
+    """)
+    for (client_id, dia, nombre, negocio, address, zone, phone,
+         service_type, pest_type, hora, price, crew) in c:
+        yield dia, None, Occurrence(
+            series_key=f"client:{client_id}", period=None, date=None,
+            time=hora or HORA_DEFAULT, client_id=client_id, client_name=nombre,
+            service_type=service_type or ("Negocio" if negocio else "Casa"),
+            pest_type=pest_type, address=address, zone=zone, phone=phone,
+            price=price, crew=crew,
+        )
+
+
+def _appointment_series(conn, clientes_mensuales):
+    """
+    Servicios mensuales: el original más sus visitas generadas.
+
+    La plantilla es la visita más reciente (si se cambió precio u hora, eso
+    sigue; si se le quitó "mensual", la serie se detiene); el día del mes
+    sale del servicio original. Los de clientes mensuales se saltan: su
+    serie de cliente ya los cubre.
+    """
+    c = conn.execute("""
+        SELECT s.serie, s.client_id, s.client_name, s.service_type, s.pest_type,
+               s.address, s.zone, s.phone, s.time, s.price, s.crew, s.notes,
+               CAST(substr(COALESCE(r.date, s.primera), 9, 2) AS INTEGER),
+               substr(COALESCE(r.date, s.primera), 1, 7)
+        FROM (
+            SELECT a.*,
+                   COALESCE(a.series_key, 'appt:' || a.id) AS serie,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY COALESCE(a.series_key, 'appt:' || a.id)
+                       ORDER BY a.date DESC, a.id DESC
+                   ) AS rn,
+                   MIN(a.date) OVER (
+                       PARTITION BY COALESCE(a.series_key, 'appt:' || a.id)
+                   ) AS primera
+            FROM appointments a
+            WHERE (a.is_monthly_service = 1 AND a.series_key IS NULL)
+               OR (a.series_key >= 'appt:' AND a.series_key < 'appt;')
+        ) s
+        LEFT JOIN appointments r ON r.id = CAST(substr(s.serie, 6) AS INTEGER)
+        WHERE s.rn = 1 AND s.is_monthly_service = 1
+        ORDER BY s.serie
+    """)
+    for (serie, client_id, nombre, service_type, pest_type, address, zone,
+         phone, hora, price, crew, notes, dia, mes_inicio) in c:
+        if client_id in clientes_mensuales or not dia:
+            continue
+        yield dia, mes_inicio, Occurrence(
+            series_key=serie, period=None, date=None, time=hora or HORA_DEFAULT,
+            client_id=client_id, client_name=nombre, service_type=service_type,
+            pest_type=pest_type, address=address, zone=zone, phone=phone,
+            price=price, crew=crew, notes=notes,
+        )
+
+
+def _series(conn):
+    """
+    Todas las series (dia, mes_inicio, plantilla), leídas una sola vez.
+
+    Las consultas con ventana recorren los servicios de las series; para
+    varios meses (preview) se calculan aquí una vez y se reusan.
+    """
+    clientes_mensuales = {
+        i for (i,) in conn.execute("SELECT id FROM clients WHERE is_monthly = 1")
+    }
+    return list(_client_series(conn)) + list(_appointment_series(conn, clientes_mensuales))
+
+
+def _month_occurrences(conn, year, month, series=None):
+    """
+    Visitas que faltan en un mes (generador).
+
+    Se salta lo que ya existe: la misma serie en ese periodo, o (para
+    clientes mensuales) cualquier servicio del cliente ya agendado a mano
+    en ese mes. `series` es lo que regresa _series(); si no se da, se lee.
+    """
+    periodo = f"{year:04d}-{month:02d}"
+    inicio, fin = f"{periodo}-01", f"{periodo}-31"
+
+    series_hechas = {
+        s for (s,) in conn.execute("""
+            SELECT COALESCE(series_key, 'appt:' || id) FROM appointments
+            WHERE date BETWEEN ? AND ?
+              AND (series_key IS NOT NULL OR is_monthly_service = 1)
+        """, (inicio, fin))
+    }
+    clientes_con_visita = {
+        i for (i,) in conn.execute(
+            "SELECT DISTINCT client_id FROM appointments "
+            "WHERE date BETWEEN ? AND ? AND client_id IS NOT NULL",
+            (inicio, fin),
+        )
+    }
+
+    if series is None:
+        series = _series(conn)
+    for dia, mes_inicio, plantilla in series:
+        if plantilla.series_key in series_hechas:
+            continue
+        if mes_inicio is None:
+            # Serie de cliente: tampoco si ya tiene algo agendado ese mes
+            if plantilla.client_id in clientes_con_visita:
+                continue
+        elif mes_inicio > periodo:
+            # Ni meses anteriores al servicio original
+            continue
+        yield replace(plantilla, period=periodo, date=visit_date(year, month, dia))
+
+
+# ---------- VISTA PREVIA Y GENERACIÓN ----------
+
+def preview(conn, desde=None, meses=12):
+    """
+    Próximas visitas pendientes de generar, sin escribir nada.
+
+    Generador mes por mes a partir del mes de `desde` (hoy si no se da),
+    hasta `meses` meses: solo se consulta el mes siguiente cuando se piden
+    más visitas, así que con itertools.islice se lee únicamente lo necesario.
+    Las series se leen una vez al empezar, no en cada mes.
+    """
+    desde = desde or date.today()
+    year, month = desde.year, desde.month
+    series = _series(conn)
+    for _ in range(meses):
+        yield from sorted(
+            _month_occurrences(conn, year, month, series), key=lambda o: (o.date, o.time)
+        )
+        year, month = next_month(date(year, month, 1))
+
+
+def generate_month(conn, year, month):
+    """
+    Crea las visitas de un mes para todas las series.
+
+    Una sola transacción con executemany; INSERT OR IGNORE sobre el índice
+    (series_key, period) la hace segura de repetir. Regresa cuántas se
+    crearon.
+    """
+    created_at = datetime.now().isoformat(timespec="seconds")
+    filas = [
+        (
+            o.client_name, o.service_type, o.pest_type, o.address, o.zone,
+            o.phone, str(o.date), o.time, o.price, STATUS_NUEVO, o.notes,
+            created_at, o.crew, o.client_id, o.series_key, o.period,
+        )
+        for o in _month_occurrences(conn, year, month)
+    ]
+    with conn:
+        c = conn.executemany("""
+            INSERT OR IGNORE INTO appointments (
+                client_name, service_type, pest_type, address, zone,
+                phone, date, time, price, status, notes,
+                created_at, is_monthly_service, crew, client_id, series_key, period
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1, ?, ?, ?, ?)
+        """, filas)
+    return c.rowcount
@@ -0,0 +1,182 @@
+import csv
+import math
+import os
+import unicodedata
+from datetime import time
+from functools import lru_cache
+
+# =========================
+# RUTAS DEL DÍA
+# =========================
+# Ordena las visitas de una cuadrilla para manejar menos. Las coordenadas
+# salen de una tabla local de colonias/zonas (zone_coords) que se llena
+# desde un CSV, sin usar internet. El orden se calcula con vecino más
+# cercano + 2-opt, respetando el orden de las visitas con hora fija.
+
+ZONES_CSV = "zonas_coordenadas.csv"
+
+
+def normalize_zone(zona):
+    """'Col. Las Águilas ' → 'las aguilas' para buscar en zone_coords."""
+    if not zona:
+        return ""
+    texto = unicodedata.normalize("NFKD", zona)
+    texto = "".join(ch for ch in texto if not unicodedata.combining(ch))
+    texto = texto.lower().strip()
+    for prefijo in ("col. ", "col ", "colonia "):
+        if texto.startswith(prefijo):
+            texto = texto[len(prefijo):]
+    return " ".join(texto.split())
+
+
+def init_zone_table(conn):
+    """Crea la tabla de coordenadas por zona si no existe."""
+    c = conn.cursor()
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS zone_coords (
+            zone TEXT PRIMARY KEY,
+            lat REAL NOT NULL,
+            lon REAL NOT NULL
+        );
+    """)
+
+
+def seed_zone_coords(conn, csv_path=ZONES_CSV):
+    """
+    Carga (o actualiza) zone_coords desde un CSV con columnas zona,lat,lon.
+
+    Las líneas que empiezan con "#" son comentarios. Regresa cuántas zonas
+    se cargaron. Si el archivo no existe no hace nada.
+    """
+    if not os.path.exists(csv_path):
+        return 0
+
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        lineas = (linea for linea in f if not linea.lstrip().startswith("#"))
+        filas = [
+            (normalize_zone(r["zona"]), float(r["lat"]), float(r["lon"]))
+            for r in csv.DictReader(lineas)
+            if r.get("zona") and r.get("lat") and r.get("lon")
+        ]
+
+    conn.executemany(
+        "INSERT OR REPLACE INTO zone_coords (zone, lat, lon) VALUES (?, ?, ?)",
+        filas,
+    )
+    conn.commit()
+    return len(filas)
+
+
+def get_zone_coords(conn):
+    """Regresa {zona_normalizada: (lat, lon)}."""
+    c = conn.cursor()
+    c.execute("SELECT zone, lat, lon FROM zone_coords")
+    return {zone: (lat, lon) for zone, lat, lon in c.fetchall()}
+
+
+def _haversine_km(a, b):
+    lat1, lon1 = map(math.radians, a)
+    lat2, lon2 = map(math.radians, b)
+    h = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * 6371.0 * math.asin(math.sqrt(h))
+
+
+@lru_cache(maxsize=64)
+def distance_matrix(coords):
+    """
+    Matriz de distancias (km) entre una tupla de coordenadas.
+
+    Se guarda en caché: el mismo día se vuelve a pedir en cada rerun.
+    """
+    n = len(coords)
+    matriz = [[0.0] * n for _ in range(n)]
+    for i in range(n):
+        for j in range(i + 1, n):
+            matriz[i][j] = matriz[j][i] = _haversine_km(coords[i], coords[j])
+    return matriz
+
+
+def _route_length(orden, dist):
+    return sum(dist[orden[i]][orden[i + 1]] for i in range(len(orden) - 1))
+
+
+def _nearest_neighbour(dist, inicio):
+    pendientes = set(range(len(dist))) - {inicio}
+    orden = [inicio]
+    while pendientes:
+        actual = orden[-1]
+        siguiente = min(pendientes, key=lambda j: dist[actual][j])
+        orden.append(siguiente)
+        pendientes.remove(siguiente)
+    return orden
+
+
+def _two_opt(orden, dist, fijos):
+    """
+    Mejora el recorrido invirtiendo tramos mientras acorte la ruta.
+
+    Un tramo invertido con dos o más visitas fijas cambiaría su orden
+    relativo, así que esas inversiones se saltan. La primera parada no se
+    mueve (es el punto de salida).
+    """
+    mejoro = True
+    while mejoro:
+        mejoro = False
+        for i in range(1, len(orden) - 1):
+            for k in range(i + 1, len(orden)):
+                if sum(1 for p in orden[i:k + 1] if p in fijos) > 1:
+                    continue
+                a, b = orden[i - 1], orden[i]
+                c = orden[k]
+                d = orden[k + 1] if k + 1 < len(orden) else None
+                antes = dist[a][b] + (dist[c][d] if d is not None else 0)
+                despues = dist[a][c] + (dist[b][d] if d is not None else 0)
+                if despues < antes - 1e-9:
+                    orden[i:k + 1] = reversed(orden[i:k + 1])
+                    mejoro = True
+    return orden
+
+
+def plan_route(visitas, coords_por_zona, fijos=()):
+    """
+    Ordena las visitas de un día para una cuadrilla.
+
+    `visitas` son registros Appointment (usa id, time y zone); `fijos` son
+    los IDs cuya hora no se puede mover (su orden entre ellos se respeta
+    por hora). Las visitas cuya zona no tiene coordenadas se dejan al final
+    por hora.
+
+    Regresa (visitas_ordenadas, km_por_tramo, km_total, km_original).
+    """
+    visitas = sorted(visitas, key=lambda v: v.time or time.min)
+    con_coords = [v for v in visitas if normalize_zone(v.zone) in coords_por_zona]
+    sin_coords = [v for v in visitas if normalize_zone(v.zone) not in coords_por_zona]
+
+    if len(con_coords) < 2:
+        return visitas, [0.0] * len(visitas), 0.0, 0.0
+
+    coords = tuple(coords_por_zona[normalize_zone(v.zone)] for v in con_coords)
+    dist = distance_matrix(coords)
+    fijos_idx = {i for i, v in enumerate(con_coords) if v.id in set(fijos)}
+
+    # Salimos de la primera visita fija (o la más temprana si no hay fijas)
+    inicio = min(fijos_idx) if fijos_idx else 0
+    orden = _nearest_neighbour(dist, inicio)
+
+    # Las fijas conservan los lugares que les tocó, pero en orden de hora
+    lugares = [pos for pos, i in enumerate(orden) if i in fijos_idx]
+    for pos, i in zip(lugares, sorted(fijos_idx)):
+        orden[pos] = i
+
+    orden = _two_opt(orden, dist, fijos_idx)
+
+    km_tramos = [0.0] + [dist[orden[i - 1]][orden[i]] for i in range(1, len(orden))]
+    km_total = _route_length(orden, dist)
+    km_original = _route_length(list(range(len(con_coords))), dist)
+
+    ordenadas = [con_coords[i] for i in orden] + sin_coords
+    km_tramos += [0.0] * len(sin_coords)
+    return ordenadas, km_tramos, km_total, km_original
@@ -0,0 +1,265 @@
+"""
+Prueba de carga: N usuarios simulados usando la app al mismo tiempo.
+
+Cada usuario es un proceso que maneja app.py sin navegador con el AppTest
+de Streamlit y repite una mezcla de acciones reales del mostrador:
+
+    buscar cliente → agendar servicio → editar servicio → exportar
+
+(exportar cuenta hasta que el Excel en segundo plano queda listo, no solo
+el clic).
+
+Todos comparten la MISMA agenda.db (en una carpeta temporal), así que la
+contención de SQLite es real. Al final se reporta:
+
+    - latencia p50 / p90 / p99 / máx por acción
+    - operaciones por segundo en total
+    - errores, y cuántos fueron "database is locked"
+    - tamaño de la BD (+ WAL) y memoria máxima (RSS) por proceso
+
+Uso:
+    python loadtest.py --users 8 --duration 60
+    python loadtest.py --users 4 --iterations 20 --seed-clients 2000
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(APP_DIR, "app.py")
+
+ACCIONES = ["buscar_cliente", "agendar_servicio", "editar_servicio", "exportar"]
+
+# Qué tan seguido hace cada acción un usuario típico
+PESOS = [5, 3, 2, 1]
+
+# Máximo que se espera a que termine una exportación en segundo plano
+EXPORT_TIMEOUT = 120
+
+
+def _por_label(elementos, label):
+    for elemento in elementos:
+        if elemento.label == label:
+            return elemento
+    raise LookupError(f"No se encontró el control {label!r}")
+
+
+def _errores(at):
+    return [str(e.value) for e in at.exception]
+
+
+# ---------- ACCIONES DE UN USUARIO ----------
+
+def buscar_cliente(at, rnd):
+    texto = rnd.choice(["Ju", "Ma", "Ta", "Jar", "Ca", "Lo"])
+    at.text_input(key="buscar_cliente").input(texto).run()
+
+
+def agendar_servicio(at, rnd):
+    n = rnd.randint(1, 10_000)
+    _por_label(at.text_input, "Nombre de la persona / contacto").input(f"Carga {n}")
+    _por_label(at.text_input, "Teléfono").input(f"55{n:08d}")
+    _por_label(at.text_input, "Colonia / zona").input(rnd.choice(["Centro", "Norte", "Sur"]))
+    _por_label(at.button, "🟩 Guardar cliente y agendar servicio").click().run()
+
+
+def editar_servicio(at, rnd):
+    at.session_state["filtro_rango_serv"] = "Todos"
+    at.run()
+    selector = _por_label(at.selectbox, "Buscar por ID de servicio")
+    ids = [o for o in selector.options if o != "--"]
+    if not ids:
+        return
+    selector.select(rnd.choice(ids))
+    _por_label(at.button, "🔍 Buscar servicio").click().run()
+    _por_label(at.button, "💾 Guardar cambios del servicio").click().run()
+
+
+def exportar(at, rnd):
+    """
+    Pide el Excel y espera a que el trabajo en segundo plano termine.
+
+    El botón solo lo manda al pool (fx_db.jobs) de este mismo proceso; la
+    latencia que importa es hasta que el archivo está listo. Regresa los
+    errores del trabajo (p. ej. "database is locked").
+    """
+    from fx_db import jobs
+
+    antes = len(_mis_trabajos)
+    _por_label(at.button, "📊 Exportar a Excel").click().run()
+    if len(_mis_trabajos) == antes:
+        return ["Exportación: el botón no mandó ningún trabajo"]
+    job_id = _mis_trabajos[-1]
+
+    limite = time.monotonic() + EXPORT_TIMEOUT
+    while time.monotonic() < limite:
+        job = jobs.get_job("agenda.db", job_id)
+        if job["status"] == jobs.ESTADO_LISTO:
+            return []
+        if job["status"] in (jobs.ESTADO_ERROR, jobs.ESTADO_INTERRUMPIDO):
+            return [f"Exportación: {job['error'] or job['status']}"]
+        time.sleep(0.05)
+    return [f"Exportación: no terminó en {EXPORT_TIMEOUT} s"]
+
+
+# IDs de los trabajos que mandó la app en ESTE proceso (los demás usuarios
+# escriben en la misma tabla jobs)
+_mis_trabajos = []
+
+
+def _registrar_trabajos():
+    from fx_db import jobs
+
+    original = jobs.submit_job
+
+    def submit_job(*args, **kwargs):
+        job_id = original(*args, **kwargs)
+        _mis_trabajos.append(job_id)
+        return job_id
+
+    jobs.submit_job = submit_job
+
+
+FUNCIONES = {
+    "buscar_cliente": buscar_cliente,
+    "agendar_servicio": agendar_servicio,
+    "editar_servicio": editar_servicio,
+    "exportar": exportar,
+}
+
+
+def _usuario(args):
+    """Un usuario simulado (corre en su propio proceso)."""
+    workdir, semilla, duracion, iteraciones = args
+    from streamlit.testing.v1 import AppTest
+
+    sys.path.insert(0, APP_DIR)
+    os.chdir(workdir)
+    _registrar_trabajos()
+    rnd = random.Random(semilla)
+    medidas = []
+
+    at = AppTest.from_file(APP_PATH, default_timeout=120)
+    at.run()
+
+    fin = time.monotonic() + duracion if duracion else None
+    hechas = 0
+    while (fin is None or time.monotonic() < fin) and (not iteraciones or hechas < iteraciones):
+        accion = rnd.choices(ACCIONES, weights=PESOS)[0]
+        inicio = time.perf_counter()
+        try:
+            # Algunas acciones esperan trabajo en segundo plano y regresan
+            # sus propios errores
+            errores = (FUNCIONES[accion](at, rnd) or []) + _errores(at)
+        except Exception as e:
+            errores = [f"{type(e).__name__}: {e}"]
+            # Sesión nueva, como si el usuario recargara la página
+            at = AppTest.from_file(APP_PATH, default_timeout=120)
+            at.run()
+        medidas.append((accion, time.perf_counter() - inicio, errores))
+        hechas += 1
+
+    rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return medidas, rss_kb
+
+
+# ---------- PREPARACIÓN Y REPORTE ----------
+
+def sembrar(workdir, clientes):
+    """Llena la BD de prueba con clientes y un servicio por cliente."""
+    sys.path.insert(0, APP_DIR)
+    import fx_db
+
+    anterior = os.getcwd()
+    os.chdir(workdir)
+    try:
+        fx_db.init_db()
+        rnd = random.Random(0)
+        hoy = date.today()
+        for i in range(clientes):
+            nombre = f"{rnd.choice(['Juan', 'María', 'Carlos', 'Lola'])} {i}"
+            fx_db.add_client(nombre, f"Negocio {i}", "Calle 1", "Centro", f"55{i:08d}", "")
+            fx_db.add_appointment(
+                nombre, "Negocio", "cucaracha", "Calle 1", "Centro", f"55{i:08d}",
+                str(hoy + timedelta(days=rnd.randint(-30, 30))), "10:00",
+                500.0, rnd.choice(["Pendiente", "Confirmado", "Realizado", "Cobrado"]), "",
+            )
+    finally:
+        os.chdir(anterior)
+
+
+def _percentil(valores, p):
+    if not valores:
+        return 0.0
+    valores = sorted(valores)
+    k = min(len(valores) - 1, max(0, round(p / 100 * (len(valores) - 1))))
+    return valores[k]
+
+
+def reporte(resultados, segundos, workdir):
+    todas = [m for medidas, _ in resultados for m in medidas]
+
+    print(f"\n{'Acción':<18}{'n':>6}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'máx ms':>10}{'errores':>9}")
+    for accion in ACCIONES:
+        tiempos = [t * 1000 for a, t, _ in todas if a == accion]
+        errores = sum(1 for a, _, e in todas if a == accion and e)
+        print(
+            f"{accion:<18}{len(tiempos):>6}"
+            f"{_percentil(tiempos, 50):>10.0f}{_percentil(tiempos, 90):>10.0f}"
+            f"{_percentil(tiempos, 99):>10.0f}{max(tiempos, default=0):>10.0f}{errores:>9}"
+        )
+
+    errores = [e for _, _, lista in todas for e in lista]
+    bloqueos = sum(1 for e in errores if "database is locked" in e)
+    tam_db = sum(
+        os.path.getsize(os.path.join(workdir, f))
+        for f in ("agenda.db", "agenda.db-wal")
+        if os.path.exists(os.path.join(workdir, f))
+    )
+    # ru_maxrss viene en KB en Linux
+    rss_max = max((rss for _, rss in resultados), default=0) / 1024
+
+    print(f"\nOperaciones: {len(todas)} en {segundos:.1f} s → {len(todas) / segundos:.2f} ops/s")
+    print(f"Errores: {len(errores)} (database is locked: {bloqueos})")
+    print(f"BD: {tam_db / 1024 / 1024:.2f} MB · RSS máx por usuario: {rss_max:.0f} MB")
+    for e in sorted(set(errores))[:5]:
+        print(f"  - {e[:160]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=4, help="usuarios simultáneos")
+    parser.add_argument("--duration", type=float, default=30, help="segundos por usuario (0 = sin límite)")
+    parser.add_argument("--iterations", type=int, default=0, help="acciones por usuario (0 = sin límite)")
+    parser.add_argument("--seed-clients", type=int, default=200, help="clientes de arranque en la BD")
+    parser.add_argument("--keep", action="store_true", help="no borrar la carpeta temporal")
+    args = parser.parse_args()
+
+    if not args.duration and not args.iterations:
+        parser.error("pon --duration o --iterations")
+
+    workdir = tempfile.mkdtemp(prefix="fx_carga_")
+    print(f"Carpeta de prueba: {workdir}")
+    sembrar(workdir, args.seed_clients)
+
+    tareas = [(workdir, semilla, args.duration, args.iterations) for semilla in range(args.users)]
+    inicio = time.perf_counter()
+    with multiprocessing.get_context("spawn").Pool(args.users) as pool:
+        resultados = pool.map(_usuario, tareas)
+    segundos = time.perf_counter() - inicio
+
+    reporte(resultados, segundos, workdir)
+
+    if not args.keep:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()